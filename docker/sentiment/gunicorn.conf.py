@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Gunicorn settings for the sentiment service.
+
+Use with `gunicorn -c gunicorn.conf.py ...`. This file is kept out of
+the sentiment package, so that loading it does not import the app
+(and torch, transformers, spaCy...) in the gunicorn master.
+"""
+# pylint: disable=import-error,import-outside-toplevel,unused-argument
+
+import os
+
+
+def post_worker_init(worker):
+    """
+    Start the inference pools once the app is loaded in the worker,
+    and before the worker starts its threads.
+    """
+    # The worker has already loaded the app
+    from sentiment.__main__ import start_pools
+    start_pools()
+
+
+def child_exit(server, worker):
+    """Discard the live metrics of a dead worker"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR', None):
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:
+            return
+        multiprocess.mark_process_dead(worker.pid)
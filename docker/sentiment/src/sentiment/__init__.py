@@ -1,4 +1,4 @@
 #!/usr/bin/env python
 # pylint: disable=import-error,too-few-public-methods
 
-from sentiment.__main__ import setupApp, Pipeline, Spellcheck
\ No newline at end of file
+from sentiment.__main__ import setupApp, LRUCache, Pipeline, ScoreCache, Batcher, Spellcheck
\ No newline at end of file
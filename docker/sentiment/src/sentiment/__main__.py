@@ -3,15 +3,36 @@
 # pylint: disable=import-error,too-few-public-methods
 
 import os
+import gc
+import io
+import signal
+import struct
+import contextlib
+import cProfile
+import pstats
 import string
 import random
 import json
-from collections import Counter
+import queue
+import atexit
+import fcntl
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import uuid
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from itertools import islice
 from functools import wraps
 from typing import Optional, Iterable, Generator, List, Dict, Callable, TypeVar, Any
 
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
+import numpy as np
 
 import jsonschema
 import textdistance
@@ -24,8 +45,24 @@ import fr_core_news_sm
 import it_core_news_sm
 import pt_core_news_sm
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
 from dotenv import load_dotenv
-from flask import Flask, Response, make_response, jsonify, request
+from flask import Flask, Response, make_response, jsonify, request, stream_with_context, g
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_swagger import swagger
 from flask_httpauth import HTTPTokenAuth
@@ -39,14 +76,27 @@ CORS(app)
 class Dependencies:
     """Dependency object to consolidate all dependencies"""
 
-    __slots__ = ['token', 'spellcheck', 'pipeline', 'port', 'debug']
+    __slots__ = [
+        'token', 'spellcheck', 'pipeline', 'scores', 'batcher', 'port', 'debug',
+        'pid', 'sentiment_pool', 'terms_pool', 'jobs', 'precision', 'stream_chunk',
+        'profiles'
+    ]
 
     def __init__(self):
         self.token: Optional[str] = None
         self.spellcheck: Optional[Spellcheck] = None
         self.pipeline: Optional[Pipeline] = None
+        self.scores: Optional[ScoreCache] = None
+        self.batcher: Optional[Batcher] = None
         self.port: Optional[int] = None
         self.debug: Optional[bool] = None
+        self.pid: Optional[int] = None
+        self.sentiment_pool: Optional[InferencePool] = None
+        self.terms_pool: Optional[InferencePool] = None
+        self.jobs: Optional[JobStore] = None
+        self.precision: Optional[int] = None
+        self.stream_chunk: int = 64
+        self.profiles: Optional[str] = None
 
 
 DEPENDENCIES = Dependencies()
@@ -57,80 +107,959 @@ def as_boolean(val: str) -> bool:
     return val.lower() in ('y', 'yes', 't', 'true', 's', 'si', 'on', '1')
 
 
+RT = TypeVar('RT')
+
+
+def chunks(items: Iterable[RT], size: int) -> Generator[List[RT], None, None]:
+    """Split an iterable into lists of up to size items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _NoMetric:
+    """Stand-in for metrics, when prometheus_client is not installed"""
+    def labels(self, *args, **kwargs) -> '_NoMetric':
+        """Labelled metrics are also disabled"""
+        return self
+
+    def inc(self, amount: float = 1):
+        """Do nothing"""
+
+    def observe(self, amount: float):
+        """Do nothing"""
+
+    def time(self) -> Any:
+        """Do nothing"""
+        return contextlib.nullcontext()
+
+
+def metric(kind: str, name: str, documentation: str, labels: Iterable[str] = (),
+           **kwargs) -> Any:
+    """Create a prometheus metric of the given kind, if enabled"""
+    if prometheus_client is None:
+        return _NoMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+# Metrics are kept per process. With several gunicorn workers or inference
+# processes, set PROMETHEUS_MULTIPROC_DIR so that they are aggregated.
+HTTP_REQUESTS = metric('Counter', 'sentiment_http_requests_total',
+                       'HTTP requests', ['endpoint', 'method', 'status'])
+HTTP_SECONDS = metric('Histogram', 'sentiment_http_request_seconds',
+                      'Time to build the HTTP response (without streaming)',
+                      ['endpoint'])
+SENTENCES = metric('Counter', 'sentiment_sentences_total',
+                   'Sentences analyzed', ['analysis'])
+SPELLCHECK_SENTENCES = metric('Counter', 'sentiment_spellcheck_sentences_total',
+                              'Sentences spell checked, by language', ['lang'])
+SPELLCHECK_SECONDS = metric('Histogram', 'sentiment_spellcheck_seconds',
+                            'Time to spell check a group of sentences, by language',
+                            ['lang'])
+BATCH_SIZE = metric('Histogram', 'sentiment_batch_size',
+                    'Sentences per model forward pass',
+                    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+BATCH_TOKENS = metric('Histogram', 'sentiment_batch_tokens',
+                      'Padded tokens per model forward pass',
+                      buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+STAGE_SECONDS = metric('Histogram', 'sentiment_stage_seconds',
+                       'Time spent in each processing stage', ['stage'])
+CACHE_LOOKUPS = metric('Counter', 'sentiment_cache_lookups_total',
+                       'Cache lookups, by result', ['cache', 'result'])
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with optional TTL.
+
+    Holds up to maxsize items (None for unbounded), evicting the least
+    recently used ones. Items older than ttl seconds (if not None)
+    are discarded on access. get_or_load makes concurrent callers
+    for the same missing key wait for a single load.
+
+    Items may also have a weight, and the least recently used ones are
+    evicted while the total weight exceeds maxweight (if not None).
+    If measure is given, the weight of loaded items is the growth of
+    measure() during the load (e.g. resident memory).
+
+    Pinned items are never evicted, and count neither towards
+    maxsize nor towards the total weight.
+    """
+    def __init__(self,
+                 maxsize: Optional[int] = 128,
+                 ttl: Optional[float] = None,
+                 maxweight: Optional[float] = None,
+                 measure: Optional[Callable[[], float]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.measure = measure
+        self.weight = 0.0
+        self.stats: Counter = Counter()
+        self._reported: Counter = Counter()
+        self._data: OrderedDict = OrderedDict()
+        self._loading: Dict[Any, threading.Event] = {}
+        self._pinned: set = set()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: Any) -> Any:
+        """Find a live item, must be called with the lock held"""
+        entry = self._data.get(key, None)
+        if entry is None:
+            return None
+        expires, value, weight = entry
+        if expires is not None and expires < time.monotonic():
+            del self._data[key]
+            self.weight -= weight
+            self.stats['expired'] += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _overflow(self) -> bool:
+        """Check if the cache is over its limits"""
+        evictable = len(self._data) - len(self._pinned)
+        if self.maxsize is not None and evictable > self.maxsize:
+            return True
+        # Never evict the last item because of its weight, it is the
+        # one just inserted and the caller is using it anyway.
+        return (self.maxweight is not None and self.weight > self.maxweight
+                and evictable > 1)
+
+    def _store(self, key: Any, value: Any, weight: float = 1.0):
+        """Insert an item, must be called with the lock held"""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        if key in self._pinned:
+            expires, weight = None, 0.0
+        previous = self._data.get(key, None)
+        if previous is not None:
+            self.weight -= previous[2]
+        self._data[key] = (expires, value, weight)
+        self._data.move_to_end(key)
+        self.weight += weight
+        while self._overflow():
+            oldest = next(item for item in self._data if item not in self._pinned)
+            _, _, evicted = self._data.pop(oldest)
+            self.weight -= evicted
+            self.stats['evictions'] += 1
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Get an item from the cache"""
+        with self._lock:
+            value = self._lookup(key)
+            self.stats['hits' if value is not None else 'misses'] += 1
+        return value if value is not None else default
+
+    def put(self, key: Any, value: Any, weight: float = 1.0):
+        """Add an item to the cache"""
+        with self._lock:
+            self._store(key, value, weight)
+
+    def get_or_load(self, key: Any, loader: Callable[[], RT]) -> RT:
+        """Get an item from the cache, loading it if missing"""
+        while True:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not None:
+                    self.stats['hits'] += 1
+                    return value
+                loading = self._loading.get(key, None)
+                if loading is None:
+                    self.stats['misses'] += 1
+                    loading = threading.Event()
+                    self._loading[key] = loading
+                    break
+            # Somebody else is loading the key, wait and check again
+            loading.wait()
+        try:
+            before = self.measure() if self.measure is not None else 0.0
+            value = loader()
+            if value is not None:
+                weight = 1.0
+                if self.measure is not None:
+                    # Concurrent loads of other keys may inflate it,
+                    # but it is a good enough estimate.
+                    weight = max(0.0, self.measure() - before)
+                with self._lock:
+                    self._store(key, value, weight)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+
+    def pin(self, key: Any) -> bool:
+        """Never evict the item, if present"""
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is None:
+                return False
+            self.weight -= entry[2]
+            self._data[key] = (None, entry[1], 0.0)
+            self._pinned.add(key)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def items(self) -> List[Any]:
+        """Snapshot of the (key, value) pairs, from oldest to newest"""
+        with self._lock:
+            return [(key, value) for key, (_, value, _) in self._data.items()]
+
+    def report(self, name: str):
+        """Add the hits and misses since the last report to the metrics"""
+        with self._lock:
+            delta = Counter(hits=self.stats['hits'], misses=self.stats['misses'])
+            delta.subtract(self._reported)
+            self._reported.update(delta)
+        for stat, label in (('hits', 'hit'), ('misses', 'miss')):
+            if delta[stat] > 0:
+                CACHE_LOOKUPS.labels(name, label).inc(delta[stat])
+
+    def info(self) -> Dict[str, Any]:
+        """Cache statistics"""
+        with self._lock:
+            info = {'size': len(self._data), 'max_size': self.maxsize, **self.stats}
+            if self._pinned:
+                info['pinned'] = len(self._pinned)
+            if self.maxweight is not None or self.measure is not None:
+                info['weight'] = self.weight
+                info['max_weight'] = self.maxweight
+            return info
+
+
+def rss_mb() -> float:
+    """Resident memory of the current process, in MB (0 if unknown)"""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
 Rating = Any
 
 
+def _inference():
+    """Context disabling autograd, the fastest way available"""
+    # inference_mode was added in torch 1.9
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+class _Logits(torch.nn.Module):
+    """Adapter exposing the model logits with positional inputs, for export"""
+    def __init__(self, model: Any, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        """Return the logits"""
+        return self.model(**dict(zip(self.input_names, inputs)))[0]
+
+
 class Pipeline:
     """Pipeline built with Hugginface's transformers"""
-    def __init__(self, model_name: str, cache_dir: Optional[str] = None):
-        """Init the pipeline from the given model name"""
+
+    backends = ('torch', 'torch-int8', 'onnx')
+
+    # Default token_budget in long text mode
+    long_text_budget = 8192
+
+    # Sentences used to check alternative backends against torch
+    _probe = [
+        'This movie was great, I loved every minute of it',
+        'El servicio fue horrible y la comida estaba fría',
+        'Ce n\'est pas mal, mais je ne reviendrai pas',
+        'Nicht gut',
+    ]
+
+    def __init__(self,
+                 model_name: str,
+                 cache_dir: Optional[str] = None,
+                 token_budget: int = 0,
+                 backend: str = 'torch',
+                 tolerance: float = 1e-2,
+                 threads: int = 0,
+                 interop_threads: int = 0,
+                 long_text: bool = False,
+                 stride: int = 128):
+        """
+        Init the pipeline from the given model name.
+
+        If token_budget > 0, sentences are sorted by tokenized length
+        and batched so that each padded batch holds at most
+        token_budget tokens, instead of batching a fixed number
+        of sentences.
+
+        backend selects the inference engine: 'torch' (fp32),
+        'torch-int8' (dynamic int8 quantization of Linear layers) or
+        'onnx' (ONNX Runtime, the exported model is cached in
+        cache_dir). Alternative backends are checked against torch
+        on startup, and if any score differs by more than tolerance,
+        the pipeline falls back to torch.
+
+        threads and interop_threads, if > 0, set the size of the
+        intra-op and inter-op thread pools of the inference engine.
+
+        If long_text, sentences longer than the model's maximum length
+        are split in windows that overlap by stride tokens, instead of
+        truncated. Windows are batched with the rest of sentences, and
+        the scores of a sentence are the mean of the scores of its
+        windows, weighted by length. Requires a fast tokenizer and
+        length-aware batching (a default token_budget is used if
+        none is given).
+        """
+        if backend not in Pipeline.backends:
+            raise ValueError(f'Unsupported backend {backend}')
+        if threads > 0:
+            torch.set_num_threads(threads)
+            if hasattr(os, 'register_at_fork'):
+                # Size the thread pool again in forked workers
+                os.register_at_fork(
+                    after_in_child=lambda: torch.set_num_threads(threads))
+        if interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError as err:
+                # Can only be set once, before any inter-op parallel work
+                print(f'Failed to set interop threads: {err}')
+        self.threads = threads
         self.tokenizer = AutoTokenizer.from_pretrained(model_name,
                                                        cache_dir=cache_dir)
         self.model = AutoModelForSequenceClassification.from_pretrained(
             model_name, cache_dir=cache_dir)
-
-    def _batch(self, sentences: List[str]) -> Iterable[Rating]:
-        """Analize a batch of sentences"""
-        tokens = self.tokenizer(sentences,
+        # Disable dropout and any other training-only behaviour
+        self.model.eval()
+        # Kept apart, alternative backends may release the model
+        self.num_labels: int = self.model.config.num_labels
+        self.token_budget = token_budget
+        self.long_text = long_text
+        self.stride = stride
+        self._windows: Dict[str, Any] = {}
+        if long_text:
+            if not self.tokenizer.is_fast:
+                raise ValueError('Long text mode requires a fast tokenizer')
+            max_length = min(self.tokenizer.model_max_length,
+                             self.model.config.max_position_embeddings)
+            if stride >= max_length - self.tokenizer.num_special_tokens_to_add():
+                raise ValueError(f'Window stride {stride} is too large '
+                                 f'for the maximum length {max_length}')
+            self._windows = {
+                'max_length': max_length,
+                'stride': stride,
+                'return_overflowing_tokens': True,
+            }
+            if token_budget <= 0:
+                # Windows must be batched by length
+                self.token_budget = Pipeline.long_text_budget
+        self.backend = 'torch'
+        self.session: Any = None
+        if backend != 'torch':
+            self._switch(backend, model_name, cache_dir, tolerance)
+
+    def _switch(self, backend: str, model_name: str, cache_dir: Optional[str],
+                tolerance: float):
+        """Replace the torch model with an alternative backend"""
+        tokens = self.tokenizer(Pipeline._probe,
                                 padding=True,
                                 truncation=True,
                                 return_tensors='pt')
-        logits = self.model(**tokens)[0]
-        #pylint: disable=no-member
-        result = torch.softmax(logits, dim=1).tolist()
+        expected = self._forward(tokens)
+        model = self.model
+        if backend == 'torch-int8':
+            self.model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            self.session = self._onnx(model_name, cache_dir)
+        # Compare with the torch output before committing to the backend
+        deviation = float(np.abs(expected - self._forward(tokens)).max())
+        if deviation > tolerance:
+            print(f"Backend '{backend}' deviates {deviation:.4f} from torch "
+                  f"(tolerance {tolerance}), falling back to torch")
+            self.model = model
+            self.session = None
+            return
+        print(f"Using backend '{backend}' (deviation {deviation:.4f})")
+        self.backend = backend
+        if self.session is not None:
+            # Release the torch weights, the session has its own copy
+            self.model = None
+
+    def _onnx(self, model_name: str, cache_dir: Optional[str]) -> Any:
+        """Export the model to ONNX (if not cached) and open a session"""
+        #pylint: disable=import-outside-toplevel
+        try:
+            import onnxruntime
+        except ImportError as err:
+            raise ValueError('onnx backend requires onnxruntime') from err
+        onnx_dir = os.path.join(cache_dir or '.', 'onnx')
+        onnx_file = os.path.join(onnx_dir, model_name.replace('/', '--') + '.onnx')
+        if not os.path.exists(onnx_file):
+            print("Exporting model to '", onnx_file, "'")
+            os.makedirs(onnx_dir, exist_ok=True)
+            sample = self.tokenizer(Pipeline._probe[:1], return_tensors='pt')
+            names = list(sample.keys())
+            # Export to a temporary file and rename, in case several
+            # workers are exporting at the same time
+            partial = f'{onnx_file}.{os.getpid()}'
+            with _inference():
+                torch.onnx.export(_Logits(self.model, names),
+                                  tuple(sample[name] for name in names),
+                                  partial,
+                                  input_names=names,
+                                  output_names=['logits'],
+                                  dynamic_axes={
+                                      **{name: {0: 'batch', 1: 'sequence'}
+                                         for name in names},
+                                      'logits': {0: 'batch'},
+                                  },
+                                  opset_version=12)
+            os.replace(partial, onnx_file)
+        options = onnxruntime.SessionOptions()
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        return onnxruntime.InferenceSession(
+            onnx_file, options, providers=['CPUExecutionProvider'])
+
+    def _forward(self, tokens: Any) -> np.ndarray:
+        """Run the model over a batch of padded tokens, as a float32 matrix"""
+        BATCH_SIZE.observe(tokens['input_ids'].shape[0])
+        BATCH_TOKENS.observe(tokens['input_ids'].numel())
+        with _inference(), STAGE_SECONDS.labels('forward').time():
+            if self.session is not None:
+                logits = torch.from_numpy(
+                    self.session.run(['logits'], {
+                        item.name: tokens[item.name].numpy()
+                        for item in self.session.get_inputs()
+                    })[0])
+            else:
+                logits = self.model(**tokens)[0]
+            #pylint: disable=no-member
+            result = torch.softmax(logits, dim=1).numpy()
         return result
 
+    def settings(self) -> Dict[str, Any]:
+        """Effective inference settings"""
+        return {
+            'backend': self.backend,
+            'token_budget': self.token_budget,
+            'long_text': self.long_text,
+            'stride': self.stride if self.long_text else None,
+            'training': bool(self.model is not None and self.model.training),
+            'inference_mode': hasattr(torch, 'inference_mode'),
+            'threads': torch.get_num_threads(),
+            'interop_threads': torch.get_num_interop_threads(),
+        }
+
+    def _batch(self, sentences: List[str]) -> np.ndarray:
+        """Analize a batch of sentences"""
+        with STAGE_SECONDS.labels('tokenize').time():
+            tokens = self.tokenizer(sentences,
+                                    padding=True,
+                                    truncation=True,
+                                    return_tensors='pt')
+        return self._forward(tokens)
+
+    def _buckets(self, lengths: List[int]) -> Generator[List[int], None, None]:
+        """Group indexes by length, keeping padded batches within budget"""
+        bucket: List[int] = []
+        for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+            # Indexes are sorted by length, so the current one
+            # sets the padded length of the bucket.
+            if bucket and (len(bucket) + 1) * lengths[index] > self.token_budget:
+                yield bucket
+                bucket = []
+            bucket.append(index)
+        if bucket:
+            yield bucket
+
+    def _sorted(self, sentences: List[str]) -> np.ndarray:
+        """Analize sentences in length-sorted batches, keeping order"""
+        if not sentences:
+            return self._empty()
+        with STAGE_SECONDS.labels('tokenize').time():
+            encoded = self.tokenizer(list(sentences), truncation=True, **self._windows)
+        # In long text mode, the sentence each window belongs to
+        owners = encoded.pop('overflow_to_sample_mapping', None)
+        features = [{key: values[index]
+                     for key, values in encoded.items()}
+                    for index in range(len(encoded['input_ids']))]
+        lengths = [len(feature['input_ids']) for feature in features]
+        results: Optional[np.ndarray] = None
+        for bucket in self._buckets(lengths):
+            with STAGE_SECONDS.labels('tokenize').time():
+                tokens = self.tokenizer.pad([features[index] for index in bucket],
+                                            return_tensors='pt')
+            scores = self._forward(tokens)
+            if results is None:
+                results = np.empty((len(features), scores.shape[1]),
+                                   dtype=scores.dtype)
+            results[bucket] = scores
+        if owners is None or len(owners) == len(sentences):
+            return results
+        # Length-weighted mean of the windows of each sentence
+        weights = np.array(lengths, dtype=np.float64)
+        combined = np.zeros((len(sentences), results.shape[1]))
+        np.add.at(combined, owners, results * weights[:, np.newaxis])
+        combined /= np.bincount(owners, weights=weights)[:, np.newaxis]
+        return combined.astype(results.dtype)
+
+    def _empty(self) -> np.ndarray:
+        """Scores for no sentences"""
+        return np.empty((0, self.num_labels), dtype=np.float32)
+
+    def matrix(self, sentences: List[str], batch_size: int = 10) -> np.ndarray:
+        """Sentiment data for a list of sentences, as a float32 matrix"""
+        if not sentences:
+            return self._empty()
+        # In length-aware mode, batch_size is the number of
+        # sentences that are sorted together.
+        analyze = self._sorted if self.token_budget > 0 else self._batch
+        return np.concatenate([
+            analyze(sentences[index:index + batch_size])
+            for index in range(0, len(sentences), batch_size)
+        ])
+
     def __call__(self,
                  sentences: List[str],
                  batch_size: int = 10) -> Generator[Rating, None, None]:
         """Generate sentiment data for a list of sentences"""
         for index in range(0, len(sentences), batch_size):
-            for row in self._batch(sentences[index:index + batch_size]):
+            for row in self.matrix(sentences[index:index + batch_size],
+                                   batch_size).tolist():
                 yield row
 
 
-RT = TypeVar('RT')
+class _SQLite:
+    """Base for objects backed by a SQLite file shared by several processes"""
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
 
+    def _db(self) -> sqlite3.Connection:
+        """SQLite connection for the current thread and process"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
 
-def memoize(func: Callable[[str], RT]) -> Callable[[str], RT]:
-    """Caching functions of one argument"""
-    #pylint: disable=dangerous-default-value
-    @wraps(func)
-    def wrapped(arg, cache=dict()):
-        cached = cache.get(arg, None)
-        if cached is None:
-            cached = func(arg)
-            if cached is not None:
-                cache[arg] = cached
-        return cached
 
-    return wrapped
+class ScoreCache(_SQLite):
+    """
+    Content-addressed cache of sentiment scores.
+
+    Scores are keyed by a hash of the model name and the text,
+    with whitespace normalized. There is a bounded in-memory LRU
+    tier and, if a path is given, a SQLite tier that is shared by
+    all the processes using the same file.
+    """
+    def __init__(self, model_name: str, size: int = 10000, path: Optional[str] = None):
+        super().__init__(path)
+        self.model_name = model_name
+        self.size = size
+        self.stats: Counter = Counter()
+        self._memory = LRUCache(maxsize=max(0, size))
+        self._lock = threading.Lock()
+        if path is not None:
+            with self._db() as db:
+                db.execute('CREATE TABLE IF NOT EXISTS scores '
+                           '(key BLOB PRIMARY KEY, scores BLOB NOT NULL)')
+
+    def key(self, text: str) -> bytes:
+        """Cache key for the text"""
+        normalized = ' '.join(text.split())
+        return hashlib.sha256('\0'.join(
+            (self.model_name, normalized)).encode('utf-8')).digest()
+
+    def get(self, keys: List[bytes]) -> List[Optional[Rating]]:
+        """Get cached scores, None for misses"""
+        result: List[Optional[Rating]] = [None] * len(keys)
+        missing: Dict[bytes, List[int]] = {}
+        for index, key in enumerate(keys):
+            row = self._memory.get(key)
+            if row is None:
+                missing.setdefault(key, []).append(index)
+            else:
+                result[index] = row
+        stats = Counter(hits=len(keys) - sum(map(len, missing.values())))
+        if missing and self.path is not None:
+            pending = list(missing.keys())
+            db = self._db()
+            # Stay below SQLite's limit of query parameters
+            for offset in range(0, len(pending), 500):
+                chunk = pending[offset:offset + 500]
+                cursor = db.execute(
+                    'SELECT key, scores FROM scores WHERE key IN (%s)' %
+                    ','.join('?' * len(chunk)), chunk)
+                for key, scores in cursor:
+                    row = np.frombuffer(scores, dtype='<f4')
+                    self._memory.put(key, row)
+                    for index in missing.pop(key):
+                        result[index] = row
+                        stats['disk_hits'] += 1
+        stats['misses'] = sum(map(len, missing.values()))
+        with self._lock:
+            self.stats.update(stats)
+        for stat, label in (('hits', 'hit'), ('disk_hits', 'disk_hit'), ('misses', 'miss')):
+            if stats[stat] > 0:
+                CACHE_LOOKUPS.labels('scores', label).inc(stats[stat])
+        return result
+
+    def put(self, items: Iterable[Any]):
+        """Store (key, score) pairs"""
+        items = tuple(items)
+        for key, row in items:
+            self._memory.put(key, row)
+        if items and self.path is not None:
+            with self._db() as db:
+                db.executemany(
+                    'INSERT OR IGNORE INTO scores (key, scores) VALUES (?, ?)',
+                    ((key, np.asarray(row, dtype='<f4').tobytes())
+                     for key, row in items))
+
+    def info(self) -> Dict[str, Any]:
+        """Cache statistics"""
+        with self._lock:
+            stats = self.stats.copy()
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        return {
+            'size': len(self._memory),
+            'max_size': self.size,
+            'path': self.path,
+            'hits': stats['hits'],
+            'disk_hits': stats['disk_hits'],
+            'misses': stats['misses'],
+            'hit_ratio': (lookups - stats['misses']) / lookups if lookups else 0.0,
+        }
+
+
+class InferencePool:
+    """
+    Pool of inference processes.
+
+    Processes are forked from the current one, so they inherit
+    (copy-on-write) the models already loaded, and the jobs
+    submitted must be module-level functions that use DEPENDENCIES.
+
+    Forking from a process that is already running threads may copy
+    locks held by those threads into the children, and hang them.
+    Call start() in each worker before it starts serving requests.
+    For the same reason, if a process dies (e.g. killed for memory),
+    the pool is not started again: jobs fail from then on, and the
+    current process is sent SIGTERM, so that gunicorn replaces the
+    whole worker.
+    """
+    def __init__(self, name: str, processes: int,
+                 initializer: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.processes = max(1, processes)
+        self.initializer = initializer
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._broken = False
+
+    def _create(self) -> ProcessPoolExecutor:
+        """Create the executor and wait for every process to be running"""
+        self._pid = os.getpid()
+        self._broken = False
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=self.initializer)
+        # With the fork context, all processes are started on first submit
+        for future in [self._executor.submit(os.getpid)
+                       for _ in range(self.processes)]:
+            future.result()
+        return self._executor
+
+    def start(self):
+        """Start the processes, if not already running for this process"""
+        self._pool()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """Get the executor, creating it if not running in this process"""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._create()
+            elif self._broken:
+                raise BrokenProcessPool(f'The {self.name} pool is broken')
+            return self._executor
+
+    def _fail(self, executor: ProcessPoolExecutor):
+        """Give up on a broken executor, and stop this process"""
+        with self._lock:
+            if self._executor is not executor or self._broken:
+                return
+            self._broken = True
+        print(f'A process of the {self.name} pool died, stopping {os.getpid()}')
+        executor.shutdown(wait=False)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def submit(self, func: Callable[..., RT], *args: Any) -> 'Future[RT]':
+        """Run func(*args) in the pool"""
+        executor = self._pool()
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            self._fail(executor)
+            raise
+
+        def check(done: Future):
+            if isinstance(done.exception(), BrokenProcessPool):
+                self._fail(executor)
+
+        future.add_done_callback(check)
+        return future
+
+    def map(self, func: Callable[[Any], List[RT]],
+            batches: Iterable[Any]) -> Generator[RT, None, None]:
+        """
+        Run func over each batch in the pool, yielding the items
+        of the results in order. Keeps up to two batches per process
+        in flight.
+        """
+        batches = iter(batches)
+        pending = deque(
+            self.submit(func, batch)
+            for batch in islice(batches, 2 * self.processes))
+        while pending:
+            result = pending.popleft().result()
+            for batch in islice(batches, 1):
+                pending.append(self.submit(func, batch))
+            for item in result:
+                yield item
+
+    def info(self) -> Dict[str, Any]:
+        """Pool settings"""
+        return {'name': self.name, 'processes': self.processes,
+                'broken': self._broken}
+
+
+class _BatchJob:
+    """Sentences submitted by a single request to the Batcher"""
+
+    __slots__ = ['results', 'pending', 'error', 'ready']
+
+    def __init__(self, size: int):
+        self.results: List[Optional[Rating]] = [None] * size
+        self.pending = size
+        self.error: Optional[BaseException] = None
+        self.ready = threading.Condition()
+
+    def resolve(self, index: int, row: Rating):
+        """Store the score of one sentence"""
+        with self.ready:
+            self.results[index] = row
+            self.pending -= 1
+            self.ready.notify_all()
+
+    def fail(self, error: BaseException):
+        """Abort the job, waking up the request"""
+        with self.ready:
+            self.error = error
+            self.ready.notify_all()
+
+    def __iter__(self) -> Generator[Rating, None, None]:
+        """Yield scores in order, as soon as they are available"""
+        for index in range(len(self.results)):
+            with self.ready:
+                while self.results[index] is None and self.error is None:
+                    self.ready.wait()
+                if self.error is not None:
+                    raise self.error
+                row = self.results[index]
+            # Release the reference, the caller owns the row now
+            self.results[index] = None
+            yield row
+
+
+class Batcher:
+    """
+    Micro-batching scheduler for the Pipeline.
+
+    Sentences from all in-flight requests are queued together, and a
+    background thread feeds them to the model in batches of up to
+    max_batch sentences. After taking the first sentence of a batch,
+    the thread waits up to max_wait_ms for more sentences to arrive.
+    Even with max_wait_ms = 0, sentences queued while the model is busy
+    are coalesced into the next batch.
+
+    If a ScoreCache is given, only the sentences missing from
+    the cache are queued.
+
+    If an InferencePool is given, batches are scored in the pool,
+    with one scheduler thread per pool process.
+    """
+    def __init__(self,
+                 pipeline: Pipeline,
+                 max_batch: int = 10,
+                 max_wait_ms: float = 0,
+                 cache: Optional[ScoreCache] = None,
+                 pool: Optional[InferencePool] = None):
+        self.pipeline = pipeline
+        self.cache = cache
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms / 1000)
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+
+    def _start(self):
+        """Start the scheduler threads, if not running in this process"""
+        with self._lock:
+            # Threads do not survive a fork, so if the Batcher was built
+            # in a gunicorn master, each worker must start its own.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._threads = []
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            count = self.pool.processes if self.pool is not None else 1
+            while len(self._threads) < count:
+                thread = threading.Thread(target=self._run,
+                                          name='batcher',
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _score(self, texts: List[str]) -> np.ndarray:
+        """Score a batch of sentences"""
+        if self.pool is not None:
+            return self.pool.submit(_pool_sentiment, texts).result()
+        return self.pipeline.matrix(texts, batch_size=len(texts))
+
+    def _collect(self) -> list:
+        """Block until there is work, and collect the next batch"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Scheduler loop"""
+        while True:
+            batch = self._collect()
+            try:
+                rows = self._score([text for _, _, text, _ in batch])
+                if self.cache is not None:
+                    self.cache.put(
+                        (key, row) for (_, _, _, key), row in zip(batch, rows))
+            #pylint: disable=broad-except
+            except Exception as err:
+                for job, _, _, _ in batch:
+                    job.fail(err)
+                continue
+            for (job, index, _, _), row in zip(batch, rows):
+                job.resolve(index, row)
+
+    def submit(self, sentences: List[str]) -> _BatchJob:
+        """Queue sentences for scoring"""
+        self._start()
+        SENTENCES.labels('sentiment').inc(len(sentences))
+        job = _BatchJob(len(sentences))
+        if self.cache is None:
+            for index, text in enumerate(sentences):
+                self._queue.put((job, index, text, None))
+            return job
+        keys = [self.cache.key(text) for text in sentences]
+        for index, (text, key, row) in enumerate(
+                zip(sentences, keys, self.cache.get(keys))):
+            if row is None:
+                self._queue.put((job, index, text, key))
+            else:
+                job.resolve(index, row)
+        return job
+
+    def __call__(self, sentences: List[str]) -> Generator[Rating, None, None]:
+        """Generate sentiment data for a list of sentences"""
+        return iter(self.submit(sentences))
+
+
+def memoize(func: Optional[Callable[[Any], RT]] = None,
+            maxsize: Optional[int] = 128,
+            ttl: Optional[float] = None,
+            cache: Optional[LRUCache] = None) -> Any:
+    """
+    Caching functions of one argument, in a LRUCache.
+
+    Can be used bare (@memoize) or with arguments
+    (@memoize(maxsize=..., ttl=...)). None results are not cached.
+    Several functions may share a cache (@memoize(cache=...)),
+    then the function name is part of the key.
+    The cache is available as the 'cache' attribute of the wrapper.
+    """
+    def decorator(func: Callable[[Any], RT]) -> Callable[[Any], RT]:
+        shared = cache is not None
+        wrapped_cache = cache if shared else LRUCache(maxsize=maxsize, ttl=ttl)
+
+        @wraps(func)
+        def wrapped(arg):
+            key = (func.__name__, arg) if shared else arg
+            return wrapped_cache.get_or_load(key, lambda: func(arg))
+
+        wrapped.cache = wrapped_cache  # type: ignore
+        return wrapped
+
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 
 NLP = Any
 
+# Language models (spaCy and hunspell) currently loaded, least
+# recently used first. Weighted by the memory they took to load,
+# so that a memory budget can be enforced.
+MODELS = LRUCache(maxsize=None, measure=rss_mb)
 
-@memoize
+
+@memoize(cache=MODELS)
 def _nlp(spacy_module: str) -> Optional[NLP]:
     print("Loading spacy language model for '", spacy_module, "'")
+    # Only the tagger / morphologizer and lemmatizer are used,
+    # do not even load the dependency parser or the entity recognizer.
+    exclude = ['parser', 'ner']
     if spacy_module == 'en':
-        nlp = en_core_web_sm.load()
+        nlp = en_core_web_sm.load(exclude=exclude)
     elif spacy_module == 'es':
-        nlp = es_core_news_sm.load()
+        nlp = es_core_news_sm.load(exclude=exclude)
     elif spacy_module == 'de':
-        nlp = de_core_news_sm.load()
+        nlp = de_core_news_sm.load(exclude=exclude)
     elif spacy_module == 'fr':
-        nlp = fr_core_news_sm.load()
+        nlp = fr_core_news_sm.load(exclude=exclude)
     elif spacy_module == 'it':
-        nlp = it_core_news_sm.load()
+        nlp = it_core_news_sm.load(exclude=exclude)
     elif spacy_module == 'pt':
-        nlp = pt_core_news_sm.load()
+        nlp = pt_core_news_sm.load(exclude=exclude)
     else:
         raise ValueError(f'Unsupported language {spacy_module}')
     return nlp
 
 
-@memoize
+@memoize(cache=MODELS)
 def _hunspell(hunspell_file: str) -> hunspell.HunSpell:
     print("Loading hunspell dictionary '", hunspell_file, "'")
     hunspell_folder = '/usr/share/hunspell'
@@ -142,6 +1071,39 @@ Sentence = Dict[str, str] # Two knwon keys: 'lang' and 'text'
 TermCount = Dict[str, int]
 
 
+def normalize(text: str) -> str:
+    """Remove variation selectors and collapse whitespace"""
+    # Variation selectors confuse the call to isupper() because they
+    # are things that modify display of emojis, not actual characters. See:
+    # https://en.wikipedia.org/wiki/Variation_Selectors_(Unicode_block)
+    return ' '.join(text.replace('\ufe0f', '').replace('\ufe0e', '').split())
+
+
+def deduplicate(sentences: Iterable[Sentence]) -> Any:
+    """
+    Normalize sentences and remove duplicates. Returns the unique
+    sentences, and the index in them of each of the original ones.
+    """
+    unique: Dict[Any, int] = {}
+    inverse: List[int] = []
+    for sentence in sentences:
+        key = (sentence['lang'], normalize(sentence['text']))
+        inverse.append(unique.setdefault(key, len(unique)))
+    return [{'lang': lang, 'text': text} for lang, text in unique], inverse
+
+
+def fan_out(results: Iterable[Any], inverse: List[int]) -> Generator[Any, None, None]:
+    """Generate the results of unique sentences in the original order"""
+    results = iter(results)
+    produced: List[Any] = []
+    for index in inverse:
+        # Unique sentences are in order of first appearance,
+        # so the result is either produced already or the next one.
+        while len(produced) <= index:
+            produced.append(next(results))
+        yield produced[index]
+
+
 class Spellcheck:
     """Spell check pipeline"""
 
@@ -172,11 +1134,99 @@ class Spellcheck:
             return None
         return _hunspell(lang_info[1])
 
-    def __init__(self):
-        """Preload all dictionaries to avoid first query delays"""
-        for lang in Spellcheck._langs:
+    def __init__(self,
+                 cache_size: int = 50000,
+                 cache_file: Optional[str] = None,
+                 batch_size: int = 64,
+                 preload: Optional[Iterable[str]] = None):
+        """
+        Preload dictionaries to avoid first query delays.
+
+        preload lists the languages to load eagerly (default, all of
+        them). The rest are loaded on first use.
+
+        Spelling corrections are cached per language, up to cache_size
+        words each. If cache_file is given, the cache is pre-warmed
+        from it and saved back to it on exit. Processes forked from
+        this one must call save_on_exit() to save their own corrections.
+
+        Sentences are processed in windows of batch_size, grouped by
+        language and fed to spaCy's nlp.pipe. To use several processes,
+        run it in an InferencePool.
+        """
+        self.batch_size = max(1, batch_size)
+        for lang in (Spellcheck._langs if preload is None else preload):
+            if lang not in Spellcheck._langs:
+                raise ValueError(f'Unsupported language {lang}')
             Spellcheck._tokenizer(lang)
             Spellcheck._checker(lang)
+        self.cache_file = cache_file
+        self._corrections = {
+            lang: LRUCache(maxsize=cache_size)
+            for lang in Spellcheck._langs
+        }
+        # Terms of corrected words, lemmatized on their own
+        self._lemmas = {
+            lang: LRUCache(maxsize=cache_size)
+            for lang in Spellcheck._langs
+        }
+        if cache_file is not None:
+            self.load()
+            atexit.register(self.save)
+
+    def save_on_exit(self):
+        """
+        Save the corrections when a multiprocessing child exits.
+
+        Children leave with os._exit, skipping the atexit handlers.
+        """
+        if self.cache_file is not None:
+            multiprocessing.util.Finalize(None, self.save, exitpriority=10)
+
+    def load(self):
+        """Pre-warm the corrections cache from the cache file"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as infile:
+                saved = json.load(infile)
+        except FileNotFoundError:
+            return
+        except ValueError as err:
+            print(f"Ignoring corrupt spelling cache '{self.cache_file}': {err}")
+            return
+        for lang, corrections in saved.items():
+            cache = self._corrections.get(lang, None)
+            if cache is not None:
+                for word, correction in corrections.items():
+                    cache.put(word, correction)
+
+    def save(self):
+        """Save the corrections cache to the cache file"""
+        saved: Dict[str, Dict[str, str]] = {}
+        # Several processes may be saving at once
+        with open(f'{self.cache_file}.lock', 'w', encoding='utf-8') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Merge with what other processes may have saved
+                with open(self.cache_file, 'r', encoding='utf-8') as infile:
+                    saved = json.load(infile)
+            except (FileNotFoundError, ValueError):
+                pass
+            for lang, cache in self._corrections.items():
+                # Entries are kept oldest first, ours are the most recent
+                merged = saved.setdefault(lang, {})
+                for word, correction in cache.items():
+                    merged.pop(word, None)
+                    merged[word] = correction
+                if cache.maxsize is not None and len(merged) > cache.maxsize:
+                    saved[lang] = dict(list(merged.items())[-cache.maxsize:])
+            partial = f'{self.cache_file}.{os.getpid()}'
+            with open(partial, 'w', encoding='utf-8') as outfile:
+                json.dump(saved, outfile, ensure_ascii=False)
+            os.replace(partial, self.cache_file)
+
+    def info(self) -> Dict[str, Any]:
+        """Corrections cache statistics, per language"""
+        return {lang: cache.info() for lang, cache in self._corrections.items()}
 
     def __call__(
         self, sentences: Iterable[Sentence]
@@ -191,43 +1241,307 @@ class Spellcheck:
                     return suggestion
             return term
 
-        def terms_of(sentence: str, lang: str) -> Optional[TermCount]:
-            """Splits sentence into lemmas"""
-            # Make sure we support the language
-            checker = Spellcheck._checker(lang)
-            tokenizer = Spellcheck._tokenizer(lang)
-            if checker is None or tokenizer is None:
-                return None
-            # Remove variation selectors, that confuse the call to isupper()
-            # because they are things that modify display of emojis, not actual
-            # characters. See:
-            # https://en.wikipedia.org/wiki/Variation_Selectors_(Unicode_block)
-            sentence = sentence.replace('\ufe0f', '').replace('\ufe0e', '')
+        def correct(token: Any, checker: hunspell.HunSpell,
+                    corrections: LRUCache) -> str:
+            """Spell check a token, remembering the result"""
+            if token.text[0].isupper():
+                return token.text
+            def check() -> str:
+                with STAGE_SECONDS.labels('hunspell').time():
+                    if checker.spell(token.norm_):
+                        return token.text
+                    return best_fit(token.text, checker.suggest)
+
+            return corrections.get_or_load(token.text, check)
+
+        def is_term(token: Any) -> bool:
+            """Skip stop words, punctuation or short words (<= 2 characters)"""
+            return not token.is_stop and not token.is_punct and len(
+                token.norm_) > 2
+
+        def term(token: Any) -> str:
+            """Lemma of the token, unless it is capitalized"""
+            return token.text if token.text[0].isupper() else token.lemma_
+
+        def lemmatize(words: List[str], tokenizer: NLP,
+                      lemmas: LRUCache) -> Iterable[str]:
+            """Lemmatize corrected words"""
+            result = []
+            missing = []
+            for word in words:
+                cached = lemmas.get(word)
+                if cached is None:
+                    missing.append(word)
+                else:
+                    result.extend(cached)
+            for word, doc in zip(missing, tokenizer.pipe(missing)):
+                # A correction may be a stop word, or several words
+                terms = tuple(term(token) for token in doc if is_term(token))
+                lemmas.put(word, terms)
+                result.extend(terms)
+            return result
+
+        def prepare(sentence: str) -> str:
+            """Clean up text before tokenizing"""
+            sentence = normalize(sentence)
             # encode to latin-1 because spell checking only supports that codec.
-            sentence = sentence.encode(encoding='latin-1', errors='ignore').decode(encoding='latin-1')
+            return sentence.encode(encoding='latin-1', errors='ignore').decode(encoding='latin-1')
+
+        def terms_of(doc: Any, lang: str, checker: hunspell.HunSpell,
+                     tokenizer: NLP) -> TermCount:
+            """Splits tokenized sentence into lemmas"""
+            corrections = self._corrections[lang]
             # Lemmatize skipping stop words
             # or short words (<= 2 characters)
-            doc = tokenizer(sentence)
-            tokens = (token for token in doc if not token.is_stop
-                      and not token.is_punct and len(token.norm_) > 2)
-            # Do spell checking on lemmas (mispelled words
-            # don't have a lemma, they drop through
-            # the previous step)
-            words = (token.text if
-                     (token.text[0].isupper() or checker.spell(token.norm_))
-                     else best_fit(token.text, checker.suggest)
-                     for token in tokens)
-            # Do a second pass to lemmatize corrected words
-            doc = tokenizer(' '.join(words))
-            words = ((token.text if token.text[0].isupper() else token.lemma_)
-                     for token in doc if not token.is_stop
-                     and not token.is_punct and len(token.norm_) > 2)
+            words = []
+            corrected = []
+            for token in filter(is_term, doc):
+                # Do spell checking on tokens. Words that are
+                # spelled right keep the lemma from this pass,
+                # only corrected words need to be lemmatized again.
+                word = correct(token, checker, corrections)
+                if word == token.text:
+                    words.append(term(token))
+                else:
+                    corrected.append(word)
+            words.extend(lemmatize(corrected, tokenizer, self._lemmas[lang]))
             return dict(Counter(word.lower() for word in words))
 
-        for sentence in sentences:
-            text = sentence['text']
-            lang = sentence['lang']
-            yield terms_of(text, lang)
+        for window in chunks(sentences, self.batch_size):
+            results: List[Optional[TermCount]] = [None] * len(window)
+            # Group by language, to run each group through nlp.pipe
+            groups: Dict[str, List[int]] = {}
+            for index, sentence in enumerate(window):
+                groups.setdefault(sentence['lang'], []).append(index)
+            for lang, indexes in groups.items():
+                # Make sure we support the language
+                checker = Spellcheck._checker(lang)
+                tokenizer = Spellcheck._tokenizer(lang)
+                if checker is None or tokenizer is None:
+                    continue
+                SPELLCHECK_SENTENCES.labels(lang).inc(len(indexes))
+                with SPELLCHECK_SECONDS.labels(lang).time():
+                    docs = tokenizer.pipe((prepare(window[index]['text'])
+                                           for index in indexes),
+                                          batch_size=self.batch_size)
+                    for index, doc in zip(indexes, docs):
+                        results[index] = terms_of(doc, lang, checker, tokenizer)
+                self._corrections[lang].report(f'corrections_{lang}')
+                self._lemmas[lang].report(f'lemmas_{lang}')
+            SENTENCES.labels('terms').inc(len(window))
+            for result in results:
+                yield result
+
+
+def _pool_sentiment(sentences: List[str]) -> np.ndarray:
+    """Score sentences, in an inference process"""
+    return DEPENDENCIES.pipeline.matrix(sentences, batch_size=len(sentences))
+
+
+def _pool_terms_init():
+    """Prepare a terms inference process"""
+    DEPENDENCIES.spellcheck.save_on_exit()
+
+
+def _pool_terms(sentences: List[Sentence]) -> List[Optional[TermCount]]:
+    """Extract terms from sentences, in an inference process"""
+    return list(DEPENDENCIES.spellcheck(sentences))
+
+
+def spellcheck(sentences: Iterable[Sentence]) -> Iterable[Optional[TermCount]]:
+    """Extract terms from sentences, in the terms pool if there is one"""
+    pool = DEPENDENCIES.terms_pool
+    if pool is None:
+        return DEPENDENCIES.spellcheck(sentences)
+    return pool.map(_pool_terms, chunks(sentences, DEPENDENCIES.spellcheck.batch_size))
+
+
+Analysis = Callable[[List[Sentence]], Iterable[Any]]
+
+
+class JobStore(_SQLite):
+    """
+    Asynchronous jobs, persisted in a SQLite file.
+
+    Jobs are run by a background thread in every process using the
+    store, in chunks of chunk_size sentences. Results are saved after
+    each chunk, so if a process dies, the job is taken over by another
+    one (or the same one, once restarted) when it has not been updated
+    in stale_s seconds, and resumed from the first missing result.
+    Finished jobs are removed after ttl_s seconds.
+    """
+    def __init__(self,
+                 path: str,
+                 analyses: Dict[str, Analysis],
+                 chunk_size: int = 256,
+                 stale_s: float = 300,
+                 ttl_s: float = 86400):
+        super().__init__(path)
+        self.analyses = analyses
+        self.chunk_size = max(1, chunk_size)
+        self.stale_s = stale_s
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        with self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                       'id TEXT PRIMARY KEY, analysis TEXT NOT NULL, '
+                       'status TEXT NOT NULL, total INTEGER NOT NULL, '
+                       'done INTEGER NOT NULL DEFAULT 0, error TEXT, '
+                       'owner TEXT, created REAL NOT NULL, updated REAL NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS items ('
+                       'job TEXT NOT NULL, idx INTEGER NOT NULL, '
+                       'lang TEXT NOT NULL, text TEXT NOT NULL, result TEXT, '
+                       'PRIMARY KEY (job, idx))')
+
+    def start(self):
+        """Start the runner thread, if not running in this process"""
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._wakeup = threading.Event()
+                self._thread = threading.Thread(target=self._run,
+                                                name='jobs',
+                                                daemon=True)
+                self._thread.start()
+
+    def create(self, analysis: str, sentences: Iterable[Sentence]) -> Dict[str, Any]:
+        """Create a job"""
+        if analysis not in self.analyses:
+            raise ValueError(f'Unsupported analysis {analysis}')
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db() as db:
+            cursor = db.executemany(
+                'INSERT INTO items (job, idx, lang, text) VALUES (?, ?, ?, ?)',
+                ((job_id, index, sentence['lang'], sentence['text'])
+                 for index, sentence in enumerate(sentences)))
+            db.execute(
+                'INSERT INTO jobs (id, analysis, status, total, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, analysis, 'pending', cursor.rowcount, now, now))
+        self.start()
+        self._wakeup.set()
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get job status, None if it does not exist"""
+        row = self._db().execute(
+            'SELECT analysis, status, total, done, error, created, updated '
+            'FROM jobs WHERE id = ?', (job_id, )).fetchone()
+        if row is None:
+            return None
+        analysis, status, total, done, error, created, updated = row
+        return {
+            'id': job_id,
+            'analysis': analysis,
+            'status': status,
+            'total': total,
+            'done': done,
+            'error': error,
+            'created': created,
+            'updated': updated,
+        }
+
+    def results(self, job_id: str, offset: int, limit: int) -> List[Any]:
+        """Get the available results in [offset, offset + limit)"""
+        results = []
+        for (result, ) in self._db().execute(
+                'SELECT result FROM items WHERE job = ? AND idx >= ? AND idx < ? '
+                'ORDER BY idx', (job_id, offset, offset + limit)):
+            if result is None:
+                # Stop at the first result not computed yet
+                break
+            results.append(json.loads(result))
+        return results
+
+    def _claim(self) -> Optional[Any]:
+        """Take ownership of the next pending (or stale) job"""
+        owner = uuid.uuid4().hex
+        now = time.time()
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, updated = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'pending' "
+                "OR (status = 'running' AND updated < ?) "
+                "ORDER BY created LIMIT 1)", (owner, now, now - self.stale_s))
+            row = db.execute('SELECT id, analysis FROM jobs WHERE owner = ?',
+                             (owner, )).fetchone()
+        if row is None:
+            return None
+        return owner, row[0], row[1]
+
+    def _process(self, owner: str, job_id: str, analysis: str):
+        """Run a job, chunk by chunk"""
+        db = self._db()
+        while True:
+            chunk = db.execute(
+                'SELECT idx, lang, text FROM items '
+                'WHERE job = ? AND result IS NULL ORDER BY idx LIMIT ?',
+                (job_id, self.chunk_size)).fetchall()
+            if not chunk:
+                break
+            unique, inverse = deduplicate({
+                'lang': lang,
+                'text': text
+            } for _, lang, text in chunk)
+            results = list(fan_out(self.analyses[analysis](unique), inverse))
+            with db:
+                db.executemany(
+                    'UPDATE items SET result = ? WHERE job = ? AND idx = ?',
+                    ((dumps(result).decode('utf-8'), job_id, index)
+                     for (index, _, _), result in zip(chunk, results)))
+                cursor = db.execute(
+                    'UPDATE jobs SET updated = ?, done = (SELECT COUNT(*) '
+                    'FROM items WHERE job = ? AND result IS NOT NULL) '
+                    'WHERE id = ? AND owner = ?',
+                    (time.time(), job_id, job_id, owner))
+            if cursor.rowcount <= 0:
+                # Somebody else took over the job
+                return
+        with db:
+            db.execute(
+                "UPDATE jobs SET status = 'done', updated = ? "
+                "WHERE id = ? AND owner = ?", (time.time(), job_id, owner))
+
+    def _cleanup(self):
+        """Remove expired jobs"""
+        with self._db() as db:
+            expired = time.time() - self.ttl_s
+            db.execute(
+                'DELETE FROM items WHERE job IN (SELECT id FROM jobs '
+                "WHERE status IN ('done', 'failed') AND updated < ?)", (expired, ))
+            db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') "
+                'AND updated < ?', (expired, ))
+
+    def _run(self):
+        """Runner loop"""
+        while True:
+            claimed = None
+            try:
+                claimed = self._claim()
+                if claimed is None:
+                    self._cleanup()
+                    # Poll for jobs created by other processes, too
+                    self._wakeup.wait(timeout=10)
+                    self._wakeup.clear()
+                    continue
+                self._process(*claimed)
+            #pylint: disable=broad-except
+            except Exception as err:
+                print(f'Job {claimed} failed: {err}')
+                if claimed is not None:
+                    owner, job_id, _ = claimed
+                    with self._db() as db:
+                        db.execute(
+                            "UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                            'WHERE id = ? AND owner = ?',
+                            (str(err), time.time(), job_id, owner))
+                else:
+                    time.sleep(10)
 
 
 # Requests schema
@@ -254,14 +1568,192 @@ schema = {
 }
 
 
+# Schema of each sentence, for NDJSON requests
+sentence_schema = schema['properties']['sentences']['items']
+
+# Asynchronous job requests schema
+jobs_schema = {
+    **schema,
+    'properties': {
+        **schema['properties'],
+        'analysis': {
+            'type': 'string',
+            'enum': ['sentiment', 'terms'],
+        },
+    },
+    'required': ['sentences', 'analysis'],
+}
+
+# Sentiment summary requests schema, sentences can be grouped
+summary_schema = {
+    'type': 'object',
+    'properties': {
+        'sentences': {
+            'type': 'array',
+            'items': {
+                **sentence_schema,
+                'properties': {
+                    **sentence_schema['properties'],
+                    'group': {
+                        'type': 'string'
+                    },
+                },
+            },
+        },
+        'percentiles': {
+            'type': 'array',
+            'items': {
+                'type': 'number',
+                'minimum': 0,
+                'maximum': 100,
+            },
+        },
+    },
+    'required': ['sentences'],
+}
+
+# Combined analysis requests schema
+analyze_schema = {
+    **schema,
+    'properties': {
+        **schema['properties'],
+        'analyses': {
+            'type': 'array',
+            'items': jobs_schema['properties']['analysis'],
+            'minItems': 1,
+        },
+    },
+}
+
+# Terms summary requests schema
+terms_summary_schema = {
+    **schema,
+    'properties': {
+        **schema['properties'],
+        'top': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'min_count': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'df': {
+            'type': 'boolean',
+        },
+    },
+}
+
+
+def _is_sentence(item: Any) -> bool:
+    """Fast check of sentence_schema"""
+    return (isinstance(item, dict) and isinstance(item.get('lang', None), str)
+            and isinstance(item.get('text', None), str))
+
+
+def _is_sentences(item: Any) -> bool:
+    """Fast check of schema"""
+    if not isinstance(item, dict):
+        return False
+    sentences = item.get('sentences', None)
+    return isinstance(sentences, list) and all(map(_is_sentence, sentences))
+
+
+def _is_job(item: Any) -> bool:
+    """Fast check of jobs_schema"""
+    return _is_sentences(item) and item.get(
+        'analysis', None) in jobs_schema['properties']['analysis']['enum']
+
+
+def _is_summary(item: Any) -> bool:
+    """Fast check of summary_schema"""
+    if not _is_sentences(item):
+        return False
+    if not all(isinstance(sentence.get('group', ''), str)
+               for sentence in item['sentences']):
+        return False
+    percentiles = item.get('percentiles', [])
+    return isinstance(percentiles, list) and all(
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+        and 0 <= value <= 100 for value in percentiles)
+
+
+def _is_analyze(item: Any) -> bool:
+    """Fast check of analyze_schema"""
+    if not _is_sentences(item):
+        return False
+    analyses = item.get('analyses', ['sentiment', 'terms'])
+    return isinstance(analyses, list) and len(analyses) > 0 and all(
+        analysis in jobs_schema['properties']['analysis']['enum']
+        for analysis in analyses)
+
+
+def _is_terms_summary(item: Any) -> bool:
+    """Fast check of terms_summary_schema"""
+    if not _is_sentences(item):
+        return False
+    for key in ('top', 'min_count'):
+        value = item.get(key, 1)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            return False
+    return isinstance(item.get('df', False), bool)
+
+
+# Hand-written equivalents of the schemas, for the valid case
+_fast_checks = {
+    id(schema): _is_sentences,
+    id(sentence_schema): _is_sentence,
+    id(jobs_schema): _is_job,
+    id(summary_schema): _is_summary,
+    id(terms_summary_schema): _is_terms_summary,
+    id(analyze_schema): _is_analyze,
+}
+
+# Validators compiled once per schema
+_validators: Dict[int, Any] = {}
+
+
+def _validator(schema: Any) -> Any:
+    """Get the compiled validator for the schema"""
+    validator = _validators.get(id(schema), None)
+    if validator is None:
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema)
+        _validators[id(schema)] = validator
+    return validator
+
+
+#pylint: disable=dangerous-default-value,redefined-outer-name
+def validation_error(item, schema: Any = schema) -> Optional[str]:
+    """Validate item with json schema, return the error if any"""
+    with STAGE_SECONDS.labels('validate').time():
+        fast_check = _fast_checks.get(id(schema), None)
+        if fast_check is not None and fast_check(item):
+            return None
+        # Use the full validator to find out what is wrong
+        error = jsonschema.exceptions.best_match(_validator(schema).iter_errors(item))
+    if error is None:
+        return None
+    path = '/'.join(str(part) for part in error.absolute_path)
+    return f'{path}: {error.message}' if path else error.message
+
+
 #pylint: disable=dangerous-default-value,redefined-outer-name
 def validate(item, schema: Any = schema) -> bool:
     """Validate item with json schema"""
-    try:
-        jsonschema.validate(instance=item, schema=schema)
-        return True
-    except jsonschema.ValidationError:
-        return False
+    return validation_error(item, schema) is None
+
+
+#pylint: disable=dangerous-default-value,redefined-outer-name
+def invalid_input(item, schema: Any = schema) -> Optional[Response]:
+    """Return an error response if item is not valid"""
+    if not item:
+        return make_response(jsonify({'error': 'Invalid input'}), 400)
+    error = validation_error(item, schema)
+    if error is None:
+        return None
+    return make_response(jsonify({'error': f'Invalid input: {error}'}), 400)
 
 
 @auth.verify_token
@@ -291,6 +1783,32 @@ def healthz():
     return jsonify({'status': 'ok'})
 
 
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics
+    ---
+    tags:
+    - metrics
+    produces:
+    - text/plain
+    responses:
+      200:
+        description: ok
+      404:
+        description: prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        return make_response(jsonify({'error': 'Metrics are not enabled'}), 404)
+    registry = prometheus_client.REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR', None):
+        # Aggregate the metrics of all the processes
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(prometheus_client.generate_latest(registry),
+                    content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
 @app.route('/spec')
 def spec():
     """Return swagger spec for this API"""
@@ -308,31 +1826,405 @@ def spec():
     return jsonify(swag)
 
 
-def make_stream_response(generator: Iterable[Any], fieldname: str) -> Response:
-    """Make a streaming response from a generator"""
-    def stream(sep=''):
-        yield '{"%s":[' % fieldname
-        for item in generator:
-            yield ''.join((sep, json.dumps(item)))
-            sep = ','
-        yield ']}'
+@app.route('/api/diagnostics')
+@auth.login_required
+def diagnostics():
+    """
+    Effective inference settings of this worker
+    ---
+    tags:
+    - diagnostics
+    security:
+    - Bearer: []
+    responses:
+      200:
+        description: ok
+        schema:
+          type: object
+      401:
+        description: forbidden
+        schema:
+          $ref: "#/definitions/error"
+    """
+    batcher = DEPENDENCIES.batcher
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count()
+    return jsonify({
+        'pid': os.getpid(),
+        'preloaded': DEPENDENCIES.pid != os.getpid(),
+        'cpus': cpus,
+        'pipeline': DEPENDENCIES.pipeline.settings(),
+        'batcher': {
+            'max_batch': batcher.max_batch,
+            'max_wait_ms': batcher.max_wait * 1000,
+        },
+        'pools': [
+            pool.info()
+            for pool in (DEPENDENCIES.sentiment_pool, DEPENDENCIES.terms_pool)
+            if pool is not None
+        ],
+        'scores_cache': batcher.cache.info() if batcher.cache is not None else None,
+        'language_models': {
+            'loaded': [list(key) for key, _ in MODELS.items()],
+            **MODELS.info(),
+        },
+        'spelling_cache': DEPENDENCIES.spellcheck.info(),
+    })
+
+
+def _plain(item: Any) -> Any:
+    """Convert numpy values for JSON serialization"""
+    if isinstance(item, (np.ndarray, np.generic)):
+        return item.tolist()
+    raise TypeError(f'Type is not JSON serializable: {type(item).__name__}')
+
+
+def dumps(item: Any) -> bytes:
+    """Serialize to JSON, with orjson if available"""
+    if orjson is not None:
+        return orjson.dumps(item, default=_plain, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(item, separators=(',', ':'), default=_plain).encode('utf-8')
+
+
+def make_stream_response(generator: Iterable[Any],
+                         fieldname: str,
+                         chunk_size: Optional[int] = None) -> Response:
+    """
+    Make a streaming response from a generator. Items are
+    serialized together in chunks of chunk_size.
+    """
+    def stream(sep=b''):
+        yield b'{"%s":[' % fieldname.encode('utf-8')
+        elapsed = 0.0
+        for chunk in chunks(generator, chunk_size or DEPENDENCIES.stream_chunk):
+            started = time.perf_counter()
+            # Serialize the chunk as a list, and strip the brackets
+            data = b''.join((sep, dumps(chunk)[1:-1]))
+            elapsed += time.perf_counter() - started
+            yield data
+            sep = b','
+        STAGE_SECONDS.labels('serialize').observe(elapsed)
+        yield b']}'
 
     return Response(stream(), mimetype='application/json')
 
 
+def score(sentences: List[str]) -> Iterable[Rating]:
+    """Score sentences, rounding to the configured precision"""
+    rows = DEPENDENCIES.batcher(sentences)
+    precision = DEPENDENCIES.precision
+    if precision is None:
+        return rows
+    return (np.round(row.astype(np.float64), precision) for row in rows)
+
+
+# Analyses available for jobs and combined requests
+ANALYSES: Dict[str, Analysis] = {
+    'sentiment': lambda sentences: score([sentence['text'] for sentence in sentences]),
+    'terms': spellcheck,
+}
+
+
+def analyze(sentences: List[Sentence], analyses: Iterable[str]) -> Iterable[Dict[str, Any]]:
+    """
+    Run several analyses over the same sentences, combining the
+    results of each sentence. The sentiment analysis is queued to
+    the batcher right away, so it runs while terms are extracted.
+    """
+    results = {name: ANALYSES[name](sentences) for name in analyses}
+    return (dict(zip(results, values)) for values in zip(*results.values()))
+
+
+def summarize(matrix: np.ndarray,
+              percentiles: Iterable[float] = (10, 25, 50, 75, 90)) -> Dict[str, Any]:
+    """
+    Summarize a matrix of scores (one row per sentence, one column
+    per star rating): expected rating, histogram of the most likely
+    rating, share of positive and negative sentences, and mean
+    probabilities.
+    """
+    count, stars = matrix.shape
+    if count == 0:
+        return {'count': 0}
+    matrix = matrix.astype(np.float64, copy=False)
+    rating = matrix @ np.arange(1, stars + 1)
+    histogram = np.bincount(matrix.argmax(axis=1), minlength=stars)
+    # Ratings below / above the middle one
+    half = stars // 2
+    percentiles = list(percentiles)
+    return {
+        'count': count,
+        'rating': {
+            'mean': float(rating.mean()),
+            'std': float(rating.std()),
+            'percentiles': dict(zip(
+                (f'{value:g}' for value in percentiles),
+                np.percentile(rating, percentiles).tolist())),
+        },
+        'histogram': histogram.tolist(),
+        'negative': float(histogram[:half].sum() / count),
+        'positive': float(histogram[stars - half:].sum() / count),
+        'probabilities': matrix.mean(axis=0).tolist(),
+    }
+
+
+def merge_terms(counts: Iterable[Optional[TermCount]],
+                top: Optional[int] = None,
+                min_count: int = 1,
+                df: bool = False) -> Dict[str, Any]:
+    """
+    Merge the term counts of several sentences. Returns the number of
+    sentences, the terms with at least min_count occurrences (the top
+    ones, if given) sorted by count, and optionally the number of
+    sentences each term appears in.
+    """
+    total: Counter = Counter()
+    documents: Counter = Counter()
+    sentences = 0
+    for terms in counts:
+        sentences += 1
+        if terms:
+            total.update(terms)
+            if df:
+                documents.update(terms.keys())
+    # most_common uses a heap when limited
+    ranked = total.most_common(top)
+    result: Dict[str, Any] = {
+        'sentences': sentences,
+        'terms': {term: count for term, count in ranked if count >= min_count},
+    }
+    if df:
+        result['documents'] = {term: documents[term] for term in result['terms']}
+    return result
+
+
+MSGPACK = 'application/x-msgpack'
+MATRIX = 'application/octet-stream'
+MATRIX_DTYPES = ('float32', 'float16')
+
+
+def make_matrix_response(rows: Iterable[Rating],
+                         count: int,
+                         mimetype: str,
+                         dtype: str = 'float32',
+                         chunk_size: Optional[int] = None) -> Response:
+    """
+    Make a streaming response with count rows of scores, packed
+    as a little-endian, row-major matrix of dtype. The matrix is
+    prefixed by a binary header (MATRIX) or wrapped in a msgpack
+    map with keys dtype, shape and scores (MSGPACK).
+    """
+    little = np.dtype(dtype).newbyteorder('<')
+
+    def header(cols: int) -> bytes:
+        if mimetype == MSGPACK:
+            packer = msgpack.Packer()
+            size = count * cols * little.itemsize
+            return b''.join((
+                packer.pack_map_header(3),
+                packer.pack('dtype'), packer.pack(little.str),
+                packer.pack('shape'), packer.pack([count, cols]),
+                # bin 32 header, the payload follows in chunks
+                packer.pack('scores'), b'\xc6', struct.pack('>I', size)))
+        return b''.join((b'SENT', struct.pack('<BBHI', 1, little.itemsize, cols, count)))
+
+    def stream():
+        started = False
+        for chunk in chunks(rows, chunk_size or DEPENDENCIES.stream_chunk):
+            matrix = np.stack(chunk).astype(little, copy=False)
+            if not started:
+                yield header(matrix.shape[1])
+                started = True
+            yield matrix.tobytes()
+        if not started:
+            yield header(DEPENDENCIES.pipeline.num_labels)
+
+    return Response(stream(), mimetype=mimetype)
+
+
+class InvalidLine(ValueError):
+    """Invalid line in a NDJSON request"""
+    def __init__(self, line: int, error: str):
+        super().__init__(f'Invalid input in line {line}: {error}')
+        self.line = line
+
+
+def ndjson_sentences(stream: Any) -> Generator[Sentence, None, None]:
+    """Read sentences from a NDJSON stream, validating each line"""
+    for number, line in enumerate(iter(stream.readline, b''), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as err:
+            raise InvalidLine(number, str(err)) from err
+        error = validation_error(item, sentence_schema)
+        if error is not None:
+            raise InvalidLine(number, error)
+        yield item
+
+
+def make_ndjson_response(sentences: Iterable[Sentence],
+                         analysis: Callable[[List[Sentence]], Iterable[Any]],
+                         batch_size: int) -> Response:
+    """
+    Make a streaming NDJSON response, with one line per sentence.
+    Sentences are read and analyzed in batches of batch_size, so that
+    the whole request is never held in memory.
+    """
+    def lines(batch: List[Sentence]) -> Generator[bytes, None, None]:
+        if batch:
+            unique, inverse = deduplicate(batch)
+            results = list(fan_out(analysis(unique), inverse))
+            with STAGE_SECONDS.labels('serialize').time():
+                data = b''.join(b''.join((dumps(item), b'\n')) for item in results)
+            yield data
+
+    def stream():
+        batch: List[Sentence] = []
+        error: Optional[InvalidLine] = None
+        try:
+            for sentence in sentences:
+                batch.append(sentence)
+                if len(batch) >= batch_size:
+                    yield from lines(batch)
+                    batch = []
+        except InvalidLine as err:
+            error = err
+        # Analyze the valid lines before the error, if any
+        yield from lines(batch)
+        if error is not None:
+            # Too late for a 400, report the error in the stream
+            yield b''.join((dumps({'error': str(error), 'line': error.line}), b'\n'))
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+
+def report_duplicates(response: Response, unique: List[Sentence],
+                      inverse: List[int]) -> Response:
+    """Add the number of duplicate sentences removed to the response"""
+    response.headers['X-Duplicates-Removed'] = str(len(inverse) - len(unique))
+    return response
+
+
+# Number of request profiles kept in DEPENDENCIES.profiles
+PROFILES_KEPT = 100
+
+# Only one request is profiled at a time
+_profiling = threading.Lock()
+
+
+def save_profile(profile: cProfile.Profile, profile_id: str):
+    """Save a request profile, removing the oldest ones"""
+    folder = DEPENDENCIES.profiles
+    profile.dump_stats(os.path.join(folder, f'{profile_id}.prof'))
+    paths = [os.path.join(folder, name) for name in os.listdir(folder)
+             if name.endswith('.prof')]
+    for path in sorted(paths, key=os.path.getmtime)[:-PROFILES_KEPT]:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+def profiled_stream(iterable: Iterable[bytes],
+                    profile: cProfile.Profile) -> Generator[bytes, None, None]:
+    """Profile the generation of each chunk of a streamed response"""
+    iterator = iter(iterable)
+    try:
+        while True:
+            profile.enable()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                profile.disable()
+            yield chunk
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def profiled(view: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Profile the request (including the streamed response) if
+    profiling is enabled and the request has a X-Profile header.
+    The id of the profile is returned in the X-Profile-Id header.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if DEPENDENCIES.profiles is None or not as_boolean(
+                request.headers.get('X-Profile', 'f')):
+            return view(*args, **kwargs)
+        if not _profiling.acquire(blocking=False):
+            return make_response(
+                jsonify({'error': 'Another request is being profiled'}), 409)
+        profile = cProfile.Profile()
+        profile_id = uuid.uuid4().hex
+
+        def done():
+            try:
+                save_profile(profile, profile_id)
+            finally:
+                _profiling.release()
+
+        try:
+            profile.enable()
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                profile.disable()
+        except BaseException:
+            _profiling.release()
+            raise
+        response.headers['X-Profile-Id'] = profile_id
+        if response.is_streamed:
+            response.response = profiled_stream(response.response, profile)
+        # Saved when the response is sent, streamed or not
+        response.call_on_close(done)
+        return response
+
+    return wrapped
+
+
+def is_ndjson() -> bool:
+    """Check if the request body is NDJSON"""
+    return request.mimetype == 'application/x-ndjson'
+
+
 @app.route('/api/sentiment', methods=['POST'])
 @auth.login_required
+@profiled
 def sentiment():
     """
-    Extract sentiment information from sentences
+    Extract sentiment information from sentences.
+    With a NDJSON body (one sentence per line), the response is also
+    NDJSON, with the scores of one sentence per line.
+    With a JSON body, scores can also be returned as a packed matrix
+    (Accept: application/octet-stream or application/x-msgpack).
     ---
     tags:
     - sentiment
+    consumes:
+    - application/json
+    - application/x-ndjson
+    produces:
+    - application/json
+    - application/x-ndjson
+    - application/octet-stream
+    - application/x-msgpack
     parameters:
     - in: body
       name: body
       schema:
         $ref: "#/definitions/sentences"
+    - in: query
+      name: dtype
+      type: string
+      enum: [float32, float16]
+      description: item type of packed matrix responses
     security:
     - Bearer: []
     definitions:
@@ -384,20 +2276,153 @@ def sentiment():
         schema:
           $ref: "#/definitions/error"
     """
-    if not request.json or not validate(request.json):
-        return make_response(jsonify({'error': 'Invalid input'}), 400)
-    sentences = tuple(item['text'] for item in request.json['sentences'])
-    return make_stream_response(DEPENDENCIES.pipeline(sentences), 'scores')
+    if is_ndjson():
+        return make_ndjson_response(
+            ndjson_sentences(request.stream),
+            lambda batch: score([item['text'] for item in batch]),
+            DEPENDENCIES.batcher.max_batch)
+    error = invalid_input(request.json)
+    if error is not None:
+        return error
+    unique, inverse = deduplicate(request.json['sentences'])
+    sentences = tuple(item['text'] for item in unique)
+    formats = ['application/json', MATRIX] + ([MSGPACK] if msgpack is not None else [])
+    mimetype = request.accept_mimetypes.best_match(formats, default=formats[0])
+    if mimetype == formats[0]:
+        return report_duplicates(
+            make_stream_response(fan_out(score(sentences), inverse), 'scores'),
+            unique, inverse)
+    dtype = request.args.get('dtype', MATRIX_DTYPES[0])
+    if dtype not in MATRIX_DTYPES:
+        return make_response(jsonify({'error': f'Unsupported dtype {dtype}'}), 400)
+    # Packed matrices are not rounded, precision is fixed by the dtype
+    return report_duplicates(
+        make_matrix_response(fan_out(DEPENDENCIES.batcher(sentences), inverse),
+                             len(inverse), mimetype, dtype), unique, inverse)
+
+
+@app.route('/api/sentiment/summary', methods=['POST'])
+@auth.login_required
+@profiled
+def sentiment_summary():
+    """
+    Summarize the sentiment of sentences, without per-sentence scores.
+    If sentences have a group, each group is also summarized.
+    ---
+    tags:
+    - sentiment
+    parameters:
+    - in: body
+      name: body
+      schema:
+        id: summary_request
+        properties:
+          sentences:
+            type: array
+            items:
+              type: object
+              properties:
+                lang:
+                  type: string
+                text:
+                  type: string
+                group:
+                  type: string
+              required:
+              - lang
+              - text
+          percentiles:
+            type: array
+            description: percentiles of the expected rating (default 10, 25, 50, 75, 90)
+            items:
+              type: number
+        required:
+        - sentences
+    security:
+    - Bearer: []
+    definitions:
+    - schema:
+        id: summary
+        properties:
+          count:
+            type: integer
+          rating:
+            type: object
+            description: expected star rating (mean, std and percentiles)
+          histogram:
+            type: array
+            description: number of sentences by most likely rating
+            items:
+              type: integer
+          negative:
+            type: number
+          positive:
+            type: number
+          probabilities:
+            type: array
+            description: mean probability of each rating
+            items:
+              type: number
+    responses:
+      200:
+        description: ok
+        schema:
+          type: object
+          properties:
+            summary:
+              $ref: "#/definitions/summary"
+            groups:
+              type: object
+              additionalProperties:
+                $ref: "#/definitions/summary"
+      400:
+        description: Invalid input
+        schema:
+          $ref: "#/definitions/error"
+      401:
+        description: forbidden
+        schema:
+          $ref: "#/definitions/error"
+    """
+    error = invalid_input(request.json, summary_schema)
+    if error is not None:
+        return error
+    sentences = request.json['sentences']
+    percentiles = request.json.get('percentiles', None) or (10, 25, 50, 75, 90)
+    unique, inverse = deduplicate(sentences)
+    rows = list(DEPENDENCIES.batcher([item['text'] for item in unique]))
+    # Expand the scores of unique sentences to all of them
+    matrix = np.stack(rows)[inverse] if rows else DEPENDENCIES.pipeline.matrix([])
+    groups: Dict[str, List[int]] = {}
+    for index, item in enumerate(sentences):
+        if 'group' in item:
+            groups.setdefault(item['group'], []).append(index)
+    result: Dict[str, Any] = {'summary': summarize(matrix, percentiles)}
+    if groups:
+        result['groups'] = {
+            group: summarize(matrix[indexes], percentiles)
+            for group, indexes in groups.items()
+        }
+    return report_duplicates(jsonify(result), unique, inverse)
 
 
 @app.route('/api/terms', methods=['POST'])
 @auth.login_required
+@profiled
 def terms():
     """
-    Spell check input sentences
+    Spell check input sentences.
+    With a NDJSON body (one sentence per line), the response is also
+    NDJSON, with the terms of one sentence per line.
     ---
     tags:
     - terms
+    consumes:
+    - application/json
+    - application/x-ndjson
+    produces:
+    - application/json
+    - application/x-ndjson
     parameters:
     - in: body
       name: body
@@ -427,10 +2452,387 @@ def terms():
         schema:
           $ref: "#/definitions/error"
     """
-    if not request.json or not validate(request.json):
+    if is_ndjson():
+        return make_ndjson_response(ndjson_sentences(request.stream),
+                                    spellcheck,
+                                    DEPENDENCIES.spellcheck.batch_size)
+    error = invalid_input(request.json)
+    if error is not None:
+        return error
+    unique, inverse = deduplicate(request.json['sentences'])
+    return report_duplicates(
+        make_stream_response(fan_out(spellcheck(unique), inverse), 'terms'),
+        unique, inverse)
+
+
+@app.route('/api/terms/summary', methods=['POST'])
+@auth.login_required
+@profiled
+def terms_summary():
+    """
+    Spell check input sentences, and merge the terms of all of them.
+    ---
+    tags:
+    - terms
+    parameters:
+    - in: body
+      name: body
+      schema:
+        id: terms_summary_request
+        properties:
+          sentences:
+            type: array
+            items:
+              $ref: "#/definitions/sentence"
+          top:
+            type: integer
+            description: return only the top terms
+          min_count:
+            type: integer
+            description: return only the terms with at least min_count occurrences
+          df:
+            type: boolean
+            description: return the number of sentences each term appears in
+        required:
+        - sentences
+    security:
+    - Bearer: []
+    responses:
+      200:
+        description: ok
+        schema:
+          id: terms_summary
+          type: object
+          properties:
+            sentences:
+              type: integer
+            terms:
+              type: object
+              additionalProperties:
+                type: integer
+            documents:
+              type: object
+              additionalProperties:
+                type: integer
+      400:
+        description: Invalid input
+        schema:
+          $ref: "#/definitions/error"
+      401:
+        description: forbidden
+        schema:
+          $ref: "#/definitions/error"
+    """
+    error = invalid_input(request.json, terms_summary_schema)
+    if error is not None:
+        return error
+    unique, inverse = deduplicate(request.json['sentences'])
+    # jsonschema accepts integral floats (2.0) as integers
+    top = request.json.get('top', None)
+    summary = merge_terms(fan_out(spellcheck(unique), inverse),
+                          top=int(top) if top is not None else None,
+                          min_count=int(request.json.get('min_count', 1)),
+                          df=request.json.get('df', False))
+    # Not jsonify, it would sort the terms by name
+    return report_duplicates(Response(dumps(summary), mimetype='application/json'),
+                             unique, inverse)
+
+
+@app.route('/api/analyze', methods=['POST'])
+@auth.login_required
+@profiled
+def analyze_sentences():
+    """
+    Run several analyses (sentiment, terms) over input sentences,
+    with one combined result per sentence.
+    With a NDJSON body (one sentence per line), the analyses are
+    given in the query string (?analyses=sentiment,terms), and the
+    response is also NDJSON, with the result of one sentence per line.
+    ---
+    tags:
+    - analyze
+    consumes:
+    - application/json
+    - application/x-ndjson
+    produces:
+    - application/json
+    - application/x-ndjson
+    parameters:
+    - in: body
+      name: body
+      schema:
+        id: analyze_request
+        properties:
+          sentences:
+            type: array
+            items:
+              $ref: "#/definitions/sentence"
+          analyses:
+            type: array
+            description: analyses to run (default, sentiment and terms)
+            items:
+              type: string
+              enum: [sentiment, terms]
+        required:
+        - sentences
+    security:
+    - Bearer: []
+    responses:
+      200:
+        description: ok
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  sentiment:
+                    type: array
+                    items:
+                      type: number
+                  terms:
+                    type: object
+                    additionalProperties:
+                        type: integer
+      400:
+        description: Invalid input
+        schema:
+          $ref: "#/definitions/error"
+      401:
+        description: forbidden
+        schema:
+          $ref: "#/definitions/error"
+    """
+    if is_ndjson():
+        analyses = [
+            name.strip()
+            for name in request.args.get('analyses', ','.join(ANALYSES)).split(',')
+        ]
+        error = invalid_input({'sentences': [], 'analyses': analyses}, analyze_schema)
+        if error is not None:
+            return error
+        return make_ndjson_response(ndjson_sentences(request.stream),
+                                    lambda batch: analyze(batch, analyses),
+                                    DEPENDENCIES.spellcheck.batch_size)
+    error = invalid_input(request.json, analyze_schema)
+    if error is not None:
+        return error
+    unique, inverse = deduplicate(request.json['sentences'])
+    analyses = request.json.get('analyses', list(ANALYSES))
+    return report_duplicates(
+        make_stream_response(fan_out(analyze(unique, analyses), inverse), 'results'),
+        unique, inverse)
+
+
+@app.route('/api/profiles/<profile_id>')
+@auth.login_required
+def get_profile(profile_id: str):
+    """
+    Download the profile of a request made with the X-Profile header
+    (only when MODEL_DEBUG is enabled)
+    ---
+    tags:
+    - profiles
+    produces:
+    - application/octet-stream
+    - text/plain
+    parameters:
+    - in: path
+      name: profile_id
+      type: string
+      required: true
+    - in: query
+      name: format
+      type: string
+      enum: [prof, text]
+      description: cProfile file (default) or text summary, by cumulative time
+    security:
+    - Bearer: []
+    responses:
+      200:
+        description: ok
+      404:
+        description: profile not found
+        schema:
+          $ref: "#/definitions/error"
+      401:
+        description: forbidden
+        schema:
+          $ref: "#/definitions/error"
+    """
+    if DEPENDENCIES.profiles is None or len(profile_id) != 32 or not all(
+            char in string.hexdigits for char in profile_id):
+        return make_response(jsonify({'error': 'Not found'}), 404)
+    path = os.path.join(DEPENDENCIES.profiles, f'{profile_id}.prof')
+    if not os.path.exists(path):
+        return make_response(jsonify({'error': 'Not found'}), 404)
+    if request.args.get('format', 'prof') == 'text':
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(100)
+        return Response(output.getvalue(), mimetype='text/plain')
+    with open(path, 'rb') as infile:
+        return Response(infile.read(), mimetype='application/octet-stream')
+
+
+@app.route('/api/jobs', methods=['POST'])
+@auth.login_required
+def create_job():
+    """
+    Create an asynchronous sentiment or terms job
+    ---
+    tags:
+    - jobs
+    parameters:
+    - in: body
+      name: body
+      schema:
+        id: job_request
+        properties:
+          sentences:
+            type: array
+            description: list of sentences
+            items:
+              $ref: "#/definitions/sentence"
+          analysis:
+            type: string
+            enum:
+            - sentiment
+            - terms
+        required:
+        - sentences
+        - analysis
+    security:
+    - Bearer: []
+    responses:
+      202:
+        description: accepted
+        schema:
+          $ref: "#/definitions/job"
+      400:
+        description: Invalid input
+        schema:
+          $ref: "#/definitions/error"
+      401:
+        description: forbidden
+        schema:
+          $ref: "#/definitions/error"
+    """
+    error = invalid_input(request.json, jobs_schema)
+    if error is not None:
+        return error
+    job = DEPENDENCIES.jobs.create(request.json['analysis'],
+                                   request.json['sentences'])
+    return make_response(jsonify(job), 202)
+
+
+@app.route('/api/jobs/<job_id>')
+@auth.login_required
+def get_job(job_id: str):
+    """
+    Get the status and a page of results of an asynchronous job
+    ---
+    tags:
+    - jobs
+    parameters:
+    - in: path
+      name: job_id
+      type: string
+      required: true
+    - in: query
+      name: offset
+      type: integer
+      description: index of the first result
+    - in: query
+      name: limit
+      type: integer
+      description: maximum number of results (default 1000)
+    security:
+    - Bearer: []
+    responses:
+      200:
+        description: ok
+        schema:
+          id: job
+          properties:
+            id:
+              type: string
+            analysis:
+              type: string
+            status:
+              type: string
+              enum:
+              - pending
+              - running
+              - done
+              - failed
+            total:
+              type: integer
+            done:
+              type: integer
+            error:
+              type: string
+            offset:
+              type: integer
+            next:
+              type: integer
+              description: offset of the next page, null if there are no more results yet
+            results:
+              type: array
+              items: {}
+      400:
+        description: Invalid input
+        schema:
+          $ref: "#/definitions/error"
+      401:
+        description: forbidden
+        schema:
+          $ref: "#/definitions/error"
+      404:
+        description: Not Found
+        schema:
+          $ref: "#/definitions/error"
+    """
+    try:
+        offset = max(0, int(request.args.get('offset', '0')))
+        limit = min(10000, max(1, int(request.args.get('limit', '1000'))))
+    except ValueError:
         return make_response(jsonify({'error': 'Invalid input'}), 400)
-    sentences = tuple(request.json['sentences'])
-    return make_stream_response(DEPENDENCIES.spellcheck(sentences), 'terms')
+    job = DEPENDENCIES.jobs.status(job_id)
+    if job is None:
+        return make_response(jsonify({'error': 'Not Found'}), 404)
+    results = DEPENDENCIES.jobs.results(job_id, offset, limit)
+    following = offset + len(results)
+    job.update({
+        'offset': offset,
+        'next': following if following < job['total'] else None,
+        'results': results,
+    })
+    return jsonify(job)
+
+
+@app.before_request
+def start_jobs():
+    """Make sure the jobs runner is alive in this worker"""
+    if DEPENDENCIES.jobs is not None:
+        DEPENDENCIES.jobs.start()
+
+
+@app.before_request
+def start_timer():
+    """Remember when the request started, for the metrics"""
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def count_request(response: Response) -> Response:
+    """Add the request to the metrics"""
+    endpoint = request.endpoint or 'none'
+    HTTP_REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    if 'started' in g:
+        HTTP_SECONDS.labels(endpoint).observe(time.perf_counter() - g.started)
+    return response
 
 
 #pylint: disable=unused-argument
@@ -458,6 +2860,34 @@ def setupApp():
         'MODEL_NAME',
         default='nlptown/bert-base-multilingual-uncased-sentiment')
     model_debug = as_boolean(os.getenv('MODEL_DEBUG', default='f'))
+    model_max_batch = int(os.getenv('MODEL_MAX_BATCH', default='10'))
+    model_max_wait_ms = float(os.getenv('MODEL_MAX_WAIT_MS', default='0'))
+    model_token_budget = int(os.getenv('MODEL_TOKEN_BUDGET', default='0'))
+    model_backend = os.getenv('MODEL_BACKEND', default='torch')
+    model_backend_tolerance = float(
+        os.getenv('MODEL_BACKEND_TOLERANCE', default='0.01'))
+    model_score_cache_size = int(
+        os.getenv('MODEL_SCORE_CACHE_SIZE', default='10000'))
+    model_score_cache_db = as_boolean(
+        os.getenv('MODEL_SCORE_CACHE_DB', default='f'))
+    model_spell_cache_size = int(
+        os.getenv('MODEL_SPELL_CACHE_SIZE', default='50000'))
+    model_spell_cache_file = os.getenv('MODEL_SPELL_CACHE_FILE', default='') or None
+    model_terms_batch = int(os.getenv('MODEL_TERMS_BATCH', default='64'))
+    model_preload_langs = os.getenv('MODEL_PRELOAD_LANGS', default='*')
+    model_langs_memory_mb = float(os.getenv('MODEL_LANGS_MEMORY_MB', default='0'))
+    model_sentiment_pool = int(os.getenv('MODEL_SENTIMENT_POOL', default='0'))
+    model_terms_pool = int(os.getenv('MODEL_TERMS_POOL', default='0'))
+    model_jobs_chunk = int(os.getenv('MODEL_JOBS_CHUNK', default='256'))
+    model_jobs_ttl_h = float(os.getenv('MODEL_JOBS_TTL_H', default='24'))
+    model_score_precision = int(os.getenv('MODEL_SCORE_PRECISION', default='-1'))
+    model_stream_chunk = int(os.getenv('MODEL_STREAM_CHUNK', default='64'))
+    model_torch_threads = int(os.getenv('MODEL_TORCH_THREADS', default='0'))
+    model_torch_interop_threads = int(
+        os.getenv('MODEL_TORCH_INTEROP_THREADS', default='0'))
+    model_long_text = as_boolean(os.getenv('MODEL_LONG_TEXT', default='f'))
+    model_window_stride = int(os.getenv('MODEL_WINDOW_STRIDE', default='128'))
+    model_preload = as_boolean(os.getenv('MODEL_PRELOAD', default='f'))
     model_token = os.getenv(
         'MODEL_TOKEN', ''.join(
             random.choices(string.ascii_uppercase + string.ascii_lowercase +
@@ -467,15 +2897,91 @@ def setupApp():
         # Manage X-Forwarded-Proto
         app.wsgi_app = ProxyFix(app.wsgi_app)
 
-    DEPENDENCIES.pipeline = Pipeline(model_name, cache_dir=model_cache_dir)
-    DEPENDENCIES.spellcheck = Spellcheck()
+    DEPENDENCIES.pipeline = Pipeline(model_name,
+                                     cache_dir=model_cache_dir,
+                                     token_budget=model_token_budget,
+                                     backend=model_backend,
+                                     tolerance=model_backend_tolerance,
+                                     threads=model_torch_threads,
+                                     interop_threads=model_torch_interop_threads,
+                                     long_text=model_long_text,
+                                     stride=model_window_stride)
+    if model_score_cache_size > 0 or model_score_cache_db:
+        # Backends (once validated) and long texts score differently,
+        # do not share the scores
+        score_key = f'{model_name}#backend={DEPENDENCIES.pipeline.backend}'
+        if model_long_text:
+            score_key += f'#stride={model_window_stride}'
+        DEPENDENCIES.scores = ScoreCache(
+            score_key,
+            size=model_score_cache_size,
+            path=os.path.join(model_cache_dir, 'scores.sqlite')
+            if model_score_cache_db else None)
+    if model_sentiment_pool > 0:
+        DEPENDENCIES.sentiment_pool = InferencePool('sentiment',
+                                                    model_sentiment_pool)
+    if model_terms_pool > 0:
+        DEPENDENCIES.terms_pool = InferencePool('terms', model_terms_pool,
+                                                initializer=_pool_terms_init)
+    DEPENDENCIES.batcher = Batcher(DEPENDENCIES.pipeline,
+                                   max_batch=model_max_batch,
+                                   max_wait_ms=model_max_wait_ms,
+                                   cache=DEPENDENCIES.scores,
+                                   pool=DEPENDENCIES.sentiment_pool)
+    if model_langs_memory_mb > 0 and not model_preload:
+        MODELS.maxweight = model_langs_memory_mb
+    preload = None
+    if model_preload_langs.strip() != '*':
+        preload = [lang.strip() for lang in model_preload_langs.split(',')
+                   if lang.strip()]
+    DEPENDENCIES.spellcheck = Spellcheck(preload=preload,
+                                         cache_size=model_spell_cache_size,
+                                         cache_file=model_spell_cache_file,
+                                         batch_size=model_terms_batch)
+    if model_preload:
+        # Workers share the languages loaded here copy-on-write: evicting
+        # them would free nothing, and loading them again would make a
+        # private copy. Keep them, and apply the budget to the rest.
+        for key, _ in MODELS.items():
+            MODELS.pin(key)
+        if model_langs_memory_mb > 0:
+            MODELS.maxweight = model_langs_memory_mb
+    DEPENDENCIES.jobs = JobStore(
+        os.path.join(model_cache_dir, 'jobs.sqlite'), ANALYSES,
+        chunk_size=model_jobs_chunk,
+        ttl_s=model_jobs_ttl_h * 3600)
     DEPENDENCIES.token = model_token
     DEPENDENCIES.port = model_port
     DEPENDENCIES.debug = model_debug
-
+    if model_debug:
+        DEPENDENCIES.profiles = os.path.join(model_cache_dir, 'profiles')
+        os.makedirs(DEPENDENCIES.profiles, exist_ok=True)
+    DEPENDENCIES.precision = model_score_precision if model_score_precision >= 0 else None
+    DEPENDENCIES.stream_chunk = max(1, model_stream_chunk)
+    DEPENDENCIES.pid = os.getpid()
+
+    # When gunicorn preloads the app, workers are forked from this process
+    # and share the loaded models copy-on-write. Move every object allocated
+    # so far to the permanent generation, so that garbage collection in the
+    # workers does not write to (and copy) the pages holding them.
+    if model_preload and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    # Without preload, this is already the worker process: start the
+    # pools before any thread does. Otherwise, see start_pools.
+    if not model_preload:
+        start_pools()
     return app
 
 
+def start_pools():
+    """Start the inference pools of this worker, before serving requests"""
+    for pool in (DEPENDENCIES.sentiment_pool, DEPENDENCIES.terms_pool):
+        if pool is not None:
+            pool.start()
+
+
 if __name__ == "__main__":
     app = setupApp()
     print(f"USE BEARER TOKEN '{DEPENDENCIES.token}'")
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""Benchmark the sentiment library and HTTP service"""
+# pylint: disable=import-error,protected-access
+
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import argparse
+import platform
+import subprocess
+import urllib.request
+import urllib.error
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Iterable, List, Dict, Any
+
+import numpy as np
+import torch
+
+from sentiment.__main__ import (Pipeline, Spellcheck, Sentence, chunks, schema,
+                                validation_error, _validator)
+
+# Words used to generate the corpus, by language:
+# (positive, negative, neutral)
+_words = {
+    'es': ('bueno genial excelente encantador perfecto recomendable maravilloso',
+           'malo horrible terrible pésimo decepcionante lento caro',
+           'servicio comida hotel película producto precio atención casa ciudad día'),
+    'en': ('good great excellent lovely perfect amazing wonderful',
+           'bad awful terrible poor disappointing slow expensive',
+           'service food hotel movie product price staff house city day'),
+    'de': ('gut toll ausgezeichnet schön perfekt wunderbar',
+           'schlecht schrecklich furchtbar langsam teuer enttäuschend',
+           'Service Essen Hotel Film Produkt Preis Personal Haus Stadt Tag'),
+    'fr': ('bon génial excellent charmant parfait merveilleux',
+           'mauvais horrible terrible lent cher décevant',
+           'service repas hôtel film produit prix personnel maison ville jour'),
+    'it': ('buono ottimo eccellente bello perfetto meraviglioso',
+           'cattivo orribile terribile lento caro deludente',
+           'servizio cibo albergo film prodotto prezzo personale casa città giorno'),
+    'pt': ('bom ótimo excelente lindo perfeito maravilhoso',
+           'mau horrível terrível lento caro decepcionante',
+           'serviço comida hotel filme produto preço pessoal casa cidade dia'),
+}
+
+_emojis = ('❤️', '\U0001f44d', '\U0001f621', '☹️', '\U0001f602')
+
+
+def generate(count: int, seed: int = 0) -> List[Sentence]:
+    """
+    Generate a corpus of count sentences in several languages.
+    Most sentences are short, some are longer than the model's
+    maximum length, and some are duplicated or only emojis.
+    """
+    rnd = random.Random(seed)
+    corpus: List[Sentence] = []
+    for _ in range(count):
+        if corpus and rnd.random() < 0.05:
+            corpus.append(rnd.choice(corpus))
+            continue
+        lang = rnd.choice(tuple(_words))
+        if rnd.random() < 0.03:
+            corpus.append({'lang': lang, 'text': ' '.join(rnd.choices(_emojis, k=3))})
+            continue
+        positive, negative, neutral = (words.split() for words in _words[lang])
+        mood = positive if rnd.random() < 0.5 else negative
+        length = rnd.randint(150, 600) if rnd.random() < 0.05 else int(
+            rnd.lognormvariate(2.5, 0.6)) + 2
+        words = [rnd.choice(mood if rnd.random() < 0.3 else neutral) for _ in range(length)]
+        if rnd.random() < 0.2:
+            words.append(rnd.choice(_emojis))
+        corpus.append({'lang': lang, 'text': ' '.join(words)})
+    return corpus
+
+
+def load(path: str) -> List[Sentence]:
+    """Load a corpus from a JSON request body or a NDJSON file"""
+    with open(path, 'r', encoding='utf-8') as infile:
+        if path.endswith('.json'):
+            return json.load(infile)['sentences']
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+def describe(corpus: List[Sentence]) -> Dict[str, Any]:
+    """Corpus statistics"""
+    words = np.array([len(item['text'].split()) for item in corpus])
+    return {
+        'sentences': len(corpus),
+        'languages': dict(Counter(item['lang'] for item in corpus)),
+        'unique': len({(item['lang'], item['text']) for item in corpus}),
+        'words': {
+            'mean': float(words.mean()) if len(words) else 0.0,
+            'max': int(words.max()) if len(words) else 0,
+        },
+    }
+
+
+def measure(target: str, sentences: int, seconds: float, latencies: List[float],
+            **params) -> Dict[str, Any]:
+    """Build a result record"""
+    samples = np.array(latencies) * 1000
+    result = {
+        'target': target,
+        **params,
+        'sentences': sentences,
+        'seconds': seconds,
+        'sentences_per_s': sentences / seconds if seconds > 0 else None,
+    }
+    if len(samples):
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99]).tolist()
+        result['latency_ms'] = {
+            'mean': float(samples.mean()),
+            'p50': p50,
+            'p90': p90,
+            'p99': p99,
+            'max': float(samples.max()),
+        }
+    print(json.dumps(result), file=sys.stderr)
+    return result
+
+
+def timed(calls: Iterable[Any], call: Any) -> Any:
+    """Run call over each item, returning total time and latencies"""
+    latencies = []
+    started = time.perf_counter()
+    for item in calls:
+        begin = time.perf_counter()
+        call(item)
+        latencies.append(time.perf_counter() - begin)
+    return time.perf_counter() - started, latencies
+
+
+def bench_pipeline(corpus: List[Sentence], backends: List[str], batch_sizes: List[int],
+                   token_budget: int) -> List[Dict[str, Any]]:
+    """Throughput and batch latency of Pipeline"""
+    model_name = os.getenv('MODEL_NAME',
+                           default='nlptown/bert-base-multilingual-uncased-sentiment')
+    cache_dir = os.getenv('MODEL_CACHE_DIR', '/var/cache/sentiment')
+    texts = [item['text'] for item in corpus]
+    results = []
+    for backend in backends:
+        pipeline = Pipeline(model_name, cache_dir=cache_dir, backend=backend,
+                            token_budget=token_budget)
+        # Warm up, the first batches are slower
+        pipeline.matrix(texts[:max(batch_sizes)], batch_size=max(batch_sizes))
+        for batch_size in batch_sizes:
+            seconds, latencies = timed(
+                chunks(texts, batch_size),
+                lambda batch, size=batch_size: pipeline.matrix(batch, batch_size=size))
+            results.append(
+                measure('pipeline', len(texts), seconds, latencies,
+                        backend=backend, effective_backend=pipeline.backend,
+                        batch_size=batch_size, token_budget=pipeline.token_budget))
+    return results
+
+
+def bench_spellcheck(corpus: List[Sentence],
+                     batch_sizes: List[int]) -> List[Dict[str, Any]]:
+    """Throughput and batch latency of Spellcheck, with cold caches"""
+    langs = sorted({item['lang'] for item in corpus} & set(Spellcheck._langs))
+    results = []
+    for batch_size in batch_sizes:
+        # Language models are loaded once, spelling caches start empty
+        spellcheck = Spellcheck(batch_size=batch_size, preload=langs)
+        seconds, latencies = timed(chunks(corpus, batch_size),
+                                   lambda batch, spellcheck=spellcheck: list(spellcheck(batch)))
+        results.append(
+            measure('spellcheck', len(corpus), seconds, latencies, batch_size=batch_size))
+    return results
+
+
+def bench_validation(corpus: List[Sentence], repeat: int = 10) -> List[Dict[str, Any]]:
+    """Validation time of a request with the whole corpus"""
+    body = {'sentences': corpus}
+    validator = _validator(schema)
+    results = []
+    for mode, call in (('fast', lambda _: validation_error(body)),
+                       ('jsonschema', lambda _: list(validator.iter_errors(body)))):
+        seconds, latencies = timed(range(repeat), call)
+        results.append(
+            measure('validation', len(corpus) * repeat, seconds, latencies, mode=mode))
+    return results
+
+
+def bench_http(url: str, token: str, corpus: List[Sentence], endpoints: List[str],
+               concurrencies: List[int], request_size: int, requests: int,
+               **params) -> List[Dict[str, Any]]:
+    """Throughput and request latency of the HTTP endpoints"""
+    batches = list(chunks(corpus, request_size))
+    # Warm up with a sentence of each language, so that language
+    # models loaded on first use are not part of the measures.
+    batches.insert(0, list({item['lang']: item for item in corpus}.values()))
+    bodies = [json.dumps({'sentences': batch}).encode('utf-8') for batch in batches]
+    results = []
+    for endpoint in endpoints:
+
+        def call(index: int, endpoint=endpoint) -> Any:
+            # Requests cycle through the corpus, skipping the warm up
+            index = index % (len(bodies) - 1) + 1 if index >= 0 else 0
+            body = bodies[index]
+            request = urllib.request.Request(f'{url}/api/{endpoint}', data=body, headers={
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json',
+            })
+            begin = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=300) as response:
+                    response.read()
+                ok = True
+            except (urllib.error.URLError, OSError):
+                ok = False
+            return time.perf_counter() - begin, ok, len(batches[index])
+
+        call(-1)
+        for concurrency in concurrencies:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                calls = list(executor.map(call, range(requests)))
+            seconds = time.perf_counter() - started
+            results.append(
+                measure('http', sum(count for _, ok, count in calls if ok),
+                        seconds, [latency for latency, ok, _ in calls if ok],
+                        endpoint=endpoint, concurrency=concurrency,
+                        request_size=request_size, requests=requests,
+                        errors=sum(1 for _, ok, _ in calls if not ok), **params))
+    return results
+
+
+def serve(workers: int, port: int, token: str, timeout: float = 600) -> subprocess.Popen:
+    """Start a local gunicorn server, and wait for it to be healthy"""
+    env = {**os.environ, 'MODEL_TOKEN': token, 'MODEL_WORKERS': str(workers)}
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers), '--threads', env.get('MODEL_HTTP_THREADS', '1'),
+        '-t', '300', 'sentiment:setupApp()'
+    ], env=env)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'Server exited with code {server.returncode}')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/healthz', timeout=5):
+                return server
+        except (urllib.error.URLError, OSError):
+            time.sleep(1)
+    server.terminate()
+    raise RuntimeError('Timeout waiting for the server')
+
+
+def _ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def _strings(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run the benchmarks selected in the command line"""
+    parser = argparse.ArgumentParser(prog='python -m sentiment.bench',
+                                     description=__doc__)
+    parser.add_argument('--corpus', help='corpus file, JSON request body or NDJSON '
+                        '(default, a generated corpus)')
+    parser.add_argument('--sentences', type=int, default=1000,
+                        help='size of the generated corpus')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated corpus')
+    parser.add_argument('--library', action='store_true',
+                        help='benchmark Pipeline, Spellcheck and validation in this process')
+    parser.add_argument('--backends', type=_strings, default=['torch'],
+                        help='Pipeline backends, comma separated')
+    parser.add_argument('--batch-sizes', type=_ints, default=[1, 10, 32],
+                        help='library batch sizes, comma separated')
+    parser.add_argument('--token-budget', type=int, default=0,
+                        help='Pipeline token budget')
+    parser.add_argument('--http', help='benchmark a running server at this URL')
+    parser.add_argument('--serve', type=_ints, default=[],
+                        help='benchmark local servers with these worker counts')
+    parser.add_argument('--port', type=int, default=3999, help='port of local servers')
+    parser.add_argument('--token', default=os.getenv('MODEL_TOKEN', None),
+                        help='bearer token (default, MODEL_TOKEN)')
+    parser.add_argument('--endpoints', type=_strings, default=['sentiment', 'terms'],
+                        help='HTTP endpoints, comma separated')
+    parser.add_argument('--concurrency', type=_ints, default=[1, 4, 16],
+                        help='concurrent HTTP requests, comma separated')
+    parser.add_argument('--request-size', type=int, default=10,
+                        help='sentences per HTTP request')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='HTTP requests per endpoint and concurrency')
+    parser.add_argument('--output', help='JSON output file (default, stdout)')
+    args = parser.parse_args(argv)
+    if not (args.library or args.http or args.serve):
+        parser.error('select at least one of --library, --http or --serve')
+
+    corpus = load(args.corpus) if args.corpus else generate(args.sentences, args.seed)
+    if not corpus:
+        parser.error('the corpus is empty')
+    report: Dict[str, Any] = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'arguments': vars(args),
+        'platform': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+        },
+        'corpus': describe(corpus),
+        'results': [],
+    }
+    results = report['results']
+    if args.library:
+        results.extend(bench_validation(corpus))
+        results.extend(bench_pipeline(corpus, args.backends, args.batch_sizes,
+                                      args.token_budget))
+        results.extend(bench_spellcheck(corpus, args.batch_sizes))
+    if args.http:
+        results.extend(
+            bench_http(args.http.rstrip('/'), args.token, corpus, args.endpoints,
+                       args.concurrency, args.request_size, args.requests))
+    for workers in args.serve:
+        token = args.token or secrets.token_urlsafe(24)
+        server = serve(workers, args.port, token)
+        try:
+            results.extend(
+                bench_http(f'http://127.0.0.1:{args.port}', token, corpus, args.endpoints,
+                           args.concurrency, args.request_size, args.requests,
+                           workers=workers))
+        finally:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outfile:
+            outfile.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
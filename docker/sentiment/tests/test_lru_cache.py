@@ -0,0 +1,33 @@
+"""Tests for pinned items in LRUCache"""
+# pylint: disable=import-error
+
+from sentiment.__main__ import LRUCache
+
+
+def test_pinned_not_evicted():
+    """Pinned items survive eviction and do not count towards maxsize"""
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    assert cache.pin('a')
+    cache.put('b', 2)
+    cache.put('c', 3)
+    cache.put('d', 4)
+    assert [key for key, _ in cache.items()] == ['a', 'c', 'd']
+
+
+def test_pinned_weight():
+    """Pinned items do not count towards the weight budget"""
+    cache = LRUCache(maxsize=None, maxweight=10)
+    cache.put('a', 1, weight=8)
+    cache.pin('a')
+    assert cache.weight == 0
+    cache.put('b', 2, weight=6)
+    cache.put('c', 3, weight=6)
+    assert [key for key, _ in cache.items()] == ['a', 'c']
+    assert cache.info()['pinned'] == 1
+
+
+def test_pin_missing():
+    """Only present items can be pinned"""
+    cache = LRUCache()
+    assert not cache.pin('a')
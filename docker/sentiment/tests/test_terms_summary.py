@@ -0,0 +1,72 @@
+"""Tests for the /api/terms/summary endpoint"""
+# pylint: disable=import-error,redefined-outer-name
+
+import pytest
+
+from sentiment.__main__ import app, DEPENDENCIES
+
+
+class StubSpellcheck:
+    """Spellcheck that counts the words of each sentence"""
+    batch_size = 64
+
+    def __call__(self, sentences):
+        for sentence in sentences:
+            counts = {}
+            for word in sentence['text'].split():
+                counts[word] = counts.get(word, 0) + 1
+            yield counts
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Test client with a stub spellcheck and a known token"""
+    monkeypatch.setattr(DEPENDENCIES, 'token', 'token')
+    monkeypatch.setattr(DEPENDENCIES, 'spellcheck', StubSpellcheck())
+    monkeypatch.setattr(DEPENDENCIES, 'terms_pool', None)
+    monkeypatch.setattr(DEPENDENCIES, 'jobs', None)
+    return app.test_client()
+
+
+def post(client, body):
+    """Post a terms summary request"""
+    return client.post('/api/terms/summary',
+                       headers={'Authorization': 'Bearer token'},
+                       json=body)
+
+
+SENTENCES = [
+    {'lang': 'es', 'text': 'casa perro casa'},
+    {'lang': 'es', 'text': 'casa gato'},
+]
+
+
+def test_float_top(client):
+    """top given as an integral float is accepted"""
+    response = post(client, {'sentences': SENTENCES, 'top': 2.0})
+    assert response.status_code == 200
+    assert list(response.json['terms']) == ['casa', 'perro']
+
+
+def test_float_min_count(client):
+    """min_count given as an integral float is accepted"""
+    response = post(client, {'sentences': SENTENCES, 'min_count': 2.0})
+    assert response.status_code == 200
+    assert response.json['terms'] == {'casa': 3}
+
+
+def test_top(client):
+    """Only the top terms are returned, by count"""
+    response = post(client, {'sentences': SENTENCES, 'top': 1, 'df': True})
+    assert response.status_code == 200
+    assert response.json == {
+        'sentences': 2,
+        'terms': {'casa': 3},
+        'documents': {'casa': 2},
+    }
+
+
+def test_invalid_top(client):
+    """Non-integral values are rejected"""
+    response = post(client, {'sentences': SENTENCES, 'top': 1.5})
+    assert response.status_code == 400